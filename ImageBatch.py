@@ -0,0 +1,396 @@
+"""Batch copy engine for Digital Camera IMages (DCIM).
+
+Copies a list of images to a destination folder using a bounded pool of
+worker threads, independent of the ImageCopy GUI."""
+
+import errno
+import filecmp
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from ImageExif import CaptureTime
+from ImageJournal import SourceKey
+from ImageStats import STATS, Timer
+
+BUFFER_SIZE = 4 * 1024 * 1024
+HASH_NAME = 'sha1'
+PART_SUFFIX = '.part'
+
+# Errors meaning the kernel can not copy between these two files.
+KERNEL_COPY_ERRORS = (
+        errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+        errno.ENOTSUP, errno.EBADF)
+
+class NameOptions(object):
+    """The parts which make up a destination file name: capture date,
+    capture time, user description ('' for none) and source file name."""
+    __slots__ = ('use_date', 'use_time', 'user', 'use_name')
+
+    def __init__(self, use_date=False, use_time=False, user='', use_name=True):
+        self.use_date = use_date
+        self.use_time = use_time
+        self.user = user
+        self.use_name = use_name
+
+def BuildCopyName(image, destination, cdt, options):
+    """Return the destination path for 'image' from the NameOptions.
+    'cdt' is the datetime used for the date and time parts of the name."""
+    cfn = list()
+    if options.use_date:
+        cfn.append(cdt.strftime('%Y%m%d'))
+    if options.use_time:
+        cfn.append(cdt.strftime('%H%M%S'))
+    if len(options.user):
+        cfn.append(options.user)
+    if options.use_name:
+        cfn.append(os.path.splitext(os.path.basename(image))[0])
+
+    return os.path.join(destination, "{}.jpg".format('_'.join(cfn)))
+
+def BuildCopyNames(images, destination, capture_times, options, existing=()):
+    """Return the destination paths for a list of images in one pass.
+
+    Names which collide, with each other or with the lower case file names
+    in 'existing', are given suffixes _1, _2... Suffixes are handed out in
+    order of capture time then source path, so the same images always get
+    the same names whatever order they are selected in."""
+    used = set(existing)
+    names = [None] * len(images)
+    order = sorted(
+            range(len(images)), key=lambda i: (capture_times[i], images[i]))
+    for i in order:
+        name = BuildCopyName(images[i], destination, capture_times[i], options)
+        base, ext = os.path.splitext(name)
+        suffix = 0
+        while os.path.basename(name).lower() in used:
+            suffix += 1
+            name = '{}_{}{}'.format(base, suffix, ext)
+        used.add(os.path.basename(name).lower())
+        names[i] = name
+    return names
+
+def ReadInto(fp, digest, buffer_size=BUFFER_SIZE, fout=None):
+    """Read an unbuffered file to its end into a reused buffer, updating
+    'digest' and writing to 'fout' if given. Returns the bytes read."""
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    total = 0
+    while True:
+        nbytes = fp.readinto(buf)
+        if not nbytes:
+            return total
+        digest.update(view[:nbytes])
+        if fout is not None:
+            written = 0
+            while written < nbytes:
+                written += fout.write(view[written:nbytes])
+        total += nbytes
+
+def KernelCopy(fin, fout, count):
+    """Copy 'count' bytes between the current positions of two files inside
+    the kernel, with copy_file_range or else sendfile. Returns the bytes
+    copied, which is 0 if neither is supported for these files."""
+    infd, outfd = fin.fileno(), fout.fileno()
+    total = 0
+    for name in ('copy_file_range', 'sendfile'):
+        func = getattr(os, name, None)
+        if func is None:
+            continue
+        try:
+            while total < count:
+                if name == 'sendfile':
+                    nbytes = func(outfd, infd, None, count - total)
+                else:
+                    nbytes = func(infd, outfd, count - total)
+                if not nbytes:
+                    break
+                total += nbytes
+            return total
+        except OSError as err:
+            if total or err.errno not in KERNEL_COPY_ERRORS:
+                raise
+    return total
+
+def CopyFile(src, dst, resume=False, verify=True, buffer_size=BUFFER_SIZE):
+    """Copy a single file. Returns a tuple of (bytes copied, hex digest).
+
+    The copy is written to dst + PART_SUFFIX, synced to disk and renamed once
+    complete. If 'resume' is true and a part file exists, copying continues
+    from its end.
+
+    With 'verify' the file is hashed in the same pass as it is copied, then
+    the written copy is read back and its hash compared, so a bad copy is
+    never renamed into place. The card is only read once. Without 'verify'
+    the kernel copies the file where it can and the digest is None."""
+    part = dst + PART_SUFFIX
+    digest = hashlib.new(HASH_NAME)
+    offset = 0
+    if resume and os.path.exists(part):
+        if os.path.getsize(part) <= os.path.getsize(src):
+            if verify:
+                with open(part, 'rb', buffering=0) as fp:
+                    offset = ReadInto(fp, digest, buffer_size)
+            else:
+                offset = os.path.getsize(part)
+
+    mode = 'ab' if offset else 'wb'
+    with open(src, 'rb', buffering=0) as fin, \
+            open(part, mode, buffering=0) as fout:
+        fin.seek(offset)
+        if not verify:
+            offset += KernelCopy(fin, fout, os.fstat(fin.fileno()).st_size - offset)
+        offset += ReadInto(fin, digest, buffer_size, fout)
+        os.fsync(fout.fileno())
+        if verify and hasattr(os, 'posix_fadvise'):
+            # Drop the cached pages so the copy is read back from the disk.
+            os.posix_fadvise(fout.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+    if verify:
+        VerifyPart(part, digest.hexdigest(), src, buffer_size)
+
+    PlacePart(part, dst, src)
+    return offset, digest.hexdigest() if verify else None
+
+def PlacePart(part, dst, src):
+    """Rename a part file written and verified into place as 'dst'. A file
+    already there is only replaced if it has the same contents; otherwise
+    the part file is removed and IOError raised, so no copy ever overwrites
+    another image."""
+    if os.path.exists(dst) and not filecmp.cmp(part, dst, shallow=False):
+        os.remove(part)
+        raise IOError(errno.EEXIST, "Copy of {} would overwrite another "
+                "file".format(src), dst)
+    os.replace(part, dst)
+
+def VerifyPart(part, hexdigest, src, buffer_size=BUFFER_SIZE):
+    """Read back a part file written and synced to disk, removing it and
+    raising IOError if its hash is not 'hexdigest'."""
+    check = hashlib.new(HASH_NAME)
+    with open(part, 'rb', buffering=0) as fp:
+        ReadInto(fp, check, buffer_size)
+    if check.hexdigest() != hexdigest:
+        os.remove(part)
+        raise IOError("Copy of {} failed verification".format(src))
+
+def ReadFile(src):
+    """Read a whole file into memory. Returns (data, hex digest)."""
+    with open(src, 'rb', buffering=0) as fp:
+        data = fp.readall()
+    return data, hashlib.new(HASH_NAME, data).hexdigest()
+
+def WriteFile(data, dst, hexdigest=None, verify=True, src=None,
+        buffer_size=BUFFER_SIZE):
+    """Write the contents of a source file already read into memory, the
+    same way as CopyFile: to a part file, synced, verified against
+    'hexdigest' if 'verify' and renamed into place. Returns a tuple of
+    (bytes written, hex digest)."""
+    part = dst + PART_SUFFIX
+    view = memoryview(data)
+    with open(part, 'wb', buffering=0) as fout:
+        written = 0
+        while written < len(data):
+            written += fout.write(view[written:])
+        os.fsync(fout.fileno())
+        if verify and hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fout.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+    if verify:
+        if hexdigest is None:
+            hexdigest = hashlib.new(HASH_NAME, data).hexdigest()
+        VerifyPart(part, hexdigest, src or dst, buffer_size)
+
+    PlacePart(part, dst, src or dst)
+    return len(data), hexdigest
+
+class CopyJob(object):
+    """A single source to destination copy. 'key' identifies the source in
+    the CopyJournal."""
+    __slots__ = ('source', 'destination', 'size', 'key')
+
+    def __init__(self, source, destination, size=0, key=None):
+        self.source = source
+        self.destination = destination
+        self.size = size
+        self.key = key
+
+class CopyStats(object):
+    """Running totals for a batch copy."""
+
+    def __init__(self, total_files=0, total_bytes=0):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.duplicates = []
+        self.errors = []
+        self.start = time.time()
+        self.stop = None
+
+    def elapsed(self):
+        return (self.stop or time.time()) - self.start
+
+    def mb_per_sec(self):
+        elapsed = self.elapsed()
+        return self.bytes / (1024.0 * 1024.0) / elapsed if elapsed else 0.0
+
+    def files_per_sec(self):
+        elapsed = self.elapsed()
+        return self.files / elapsed if elapsed else 0.0
+
+    def __str__(self):
+        return "{} of {} files ({} skipped, {} duplicates), {:.1f} MB in {:.2f}s ({:.1f} MB/s, {:.1f} files/s)".format(
+                self.files, self.total_files, self.skipped,
+                len(self.duplicates),
+                self.bytes / (1024.0 * 1024.0),
+                self.elapsed(), self.mb_per_sec(), self.files_per_sec())
+
+def ListDestination(destination):
+    """Lower case names of the files already in the destination folder."""
+    try:
+        return set(name.lower() for name in os.listdir(destination))
+    except OSError:
+        return set()
+
+def JournalName(journal, key, destination):
+    """The name the CopyJournal gave the image 'key' in 'destination', if
+    it is still the one to use: the copy is done, or was started and the
+    name has not been taken since. None otherwise."""
+    name = journal.destination(key)
+    if name is None or os.path.dirname(os.path.abspath(name)) != \
+            os.path.abspath(destination):
+        return None
+    if journal.is_done(key) or not os.path.exists(name):
+        return name
+    return None
+
+def BuildCopyJobs(images, destination, options, metadata=None, journal=None):
+    """Build a CopyJob for every image up front, with destination names
+    that do not collide with each other or with files already there.
+    'metadata' is an optional MetadataIndex for looking up capture times.
+
+    Images the CopyJournal 'journal' already has, copied or half copied,
+    keep the names they were given, so the suffixes of the others do not
+    shift from run to run and half written copies can be resumed. Only
+    images new to the journal are given new names."""
+    stats = [os.stat(image) for image in images]
+    keys = [SourceKey(image, st) for image, st in zip(images, stats)]
+    names = [None] * len(images)
+    if journal is not None:
+        names = [JournalName(journal, key, destination) for key in keys]
+    new = [i for i, name in enumerate(names) if name is None]
+    if new:
+        existing = ListDestination(destination)
+        existing.update(
+                os.path.basename(name).lower() for name in names if name)
+        times = [CaptureTime(images[i], metadata, stats[i]) for i in new]
+        for i, name in zip(new, BuildCopyNames(
+                [images[i] for i in new], destination, times, options,
+                existing)):
+            names[i] = name
+    return [
+            CopyJob(image, name, st.st_size, key)
+            for image, name, st, key in zip(images, names, stats, keys)]
+
+class BatchCopier(object):
+    """Copy a batch of CopyJobs with a bounded pool of worker threads.
+
+    At most 'workers' copies are in flight at once, so reads from the card
+    overlap with writes to the destination without queueing the whole batch.
+    'progress' is called with (job, stats) after each file completes.
+
+    With a CopyJournal, sources already copied are skipped and copies left
+    half written by an earlier run are resumed. With a DuplicateIndex,
+    sources whose contents are already in the library are skipped, and
+    each copy made is added to it. 'rewrite', if given, is called with each
+    job copied before it is recorded in either, and may change the copy in
+    place, e.g. ImageOrient.RotateCopied; it returns the new (size, digest)
+    of the copy, or None if it was left alone. 'derive', if given, is called
+    with each job copied, e.g. DerivativePool.copied to make previews."""
+
+    def __init__(self, workers=4, progress=None, journal=None, dupes=None,
+            verify=True, buffer_size=BUFFER_SIZE, derive=None, rewrite=None):
+        self.workers = max(1, int(workers))
+        self.progress = progress
+        self.journal = journal
+        self.dupes = dupes
+        self.verify = verify
+        self.buffer_size = buffer_size
+        self.derive = derive
+        self.rewrite = rewrite
+        self.lock = threading.Lock()
+        self.cancelled = False
+
+    def cancel(self):
+        """Stop submitting new copies, those in flight will complete."""
+        self.cancelled = True
+
+    def _copy(self, job, stats):
+        journal = self.journal if job.key else None
+        try:
+            if self.dupes is not None:
+                duplicate = self.dupes.find(job.source, job.size)
+                if duplicate:
+                    if journal is not None:
+                        journal.record(
+                                job.key, job.source, duplicate, job.size, None)
+                    with self.lock:
+                        stats.duplicates.append((job, duplicate))
+                    return
+
+            resume = False
+            if journal is not None:
+                resume = journal.is_partial(job.key, job.destination)
+                journal.start(job.key, job.source, job.destination)
+            with Timer('copy'):
+                nbytes, digest = CopyFile(
+                        job.source, job.destination, resume,
+                        self.verify, self.buffer_size)
+            STATS.incr('copy bytes', nbytes)
+            copied = None
+            if self.rewrite:
+                rewritten = self.rewrite(job)
+                if rewritten is not None:
+                    copied = (nbytes, digest) if digest else None
+                    nbytes, digest = rewritten
+            if journal is not None:
+                journal.record(
+                        job.key, job.source, job.destination, nbytes, digest)
+            if self.dupes is not None:
+                self.dupes.add(job.destination, nbytes, digest, copied)
+        except (IOError, OSError) as err:
+            with self.lock:
+                stats.errors.append((job, err))
+            return
+
+        with self.lock:
+            stats.files += 1
+            stats.bytes += nbytes
+        if self.progress:
+            self.progress(job, stats)
+        if self.derive:
+            self.derive(job)
+
+    def copy(self, jobs):
+        """Copy all the jobs, returning the CopyStats for the batch."""
+        jobs = list(jobs)
+        stats = CopyStats(len(jobs), sum(job.size for job in jobs))
+        pending = set()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for job in jobs:
+                if self.cancelled:
+                    break
+                if self.journal is not None and job.key and \
+                        self.journal.is_done(job.key):
+                    stats.skipped += 1
+                    continue
+                if len(pending) >= self.workers:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                pending.add(pool.submit(self._copy, job, stats))
+            wait(pending)
+
+        stats.stop = time.time()
+        return stats
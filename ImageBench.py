@@ -0,0 +1,354 @@
+#!/usr/bin/python
+"""Benchmarks for scanning, metadata extraction, decoding, zoom scaling and
+copying of images.
+
+A synthetic DCF card (DCIM/100BENCH, 101BENCH...) of JPEGs with EXIF data and
+embedded thumbnails is generated unless an existing card is given. Each
+result is printed as one line of JSON so runs can be compared over time."""
+
+import argparse
+import configparser
+import io
+import json
+import os
+import platform
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from PIL import Image, ImageFilter
+from ImageBatch import BatchCopier, BuildCopyJobs, NameOptions
+from ImageCache import DecodeImage
+from ImageCatalog import Catalog, SORT_CAMERA, SORT_TIME
+from ImageDerive import DerivativePool
+from ImageExif import MetadataIndex, ReadExif
+from ImageQuality import QualityIndex, ScoreImages
+from ImageScale import NearestImage, invfrange
+from ImageScan import ScanJpgFiles
+
+CANVAS_SIZE = (800, 600)
+COLD_START_TARGET = 0.5     # Seconds from launch to the last image viewed.
+
+def MakeExif(cdt, model='ImageBench', orientation=1, thumbnail=b''):
+    """Return a little endian TIFF structure for an EXIF APP1 segment with
+    IFD0 (model, orientation, date), an EXIF IFD (DateTimeOriginal and
+    SubSecTimeOriginal) and IFD1 holding a JPEG thumbnail."""
+    model_b = model.encode('ascii') + b'\x00'
+    date_b = cdt.strftime('%Y:%m:%d %H:%M:%S').encode('ascii') + b'\x00'
+    subsec_b = '{:02d}'.format(cdt.microsecond // 10000).encode('ascii') + b'\x00'
+
+    ifd0 = 8
+    exif = ifd0 + 2 + 4 * 12 + 4
+    ifd1 = exif + 2 + 2 * 12 + 4
+    data = ifd1 + 2 + 2 * 12 + 4
+    model_at = data
+    date_at = model_at + len(model_b)
+    thumb_at = date_at + len(date_b)
+
+    def entry(tag, typ, count, value):
+        if typ == 3:
+            return struct.pack('<HHIHH', tag, typ, count, value, 0)
+        return struct.pack('<HHII', tag, typ, count, value)
+
+    return b''.join([
+        b'II*\x00', struct.pack('<I', ifd0),
+        struct.pack('<H', 4),
+        entry(0x0110, 2, len(model_b), model_at),
+        entry(0x0112, 3, 1, orientation),
+        entry(0x0132, 2, len(date_b), date_at),
+        entry(0x8769, 4, 1, exif),
+        struct.pack('<I', ifd1 if thumbnail else 0),
+        struct.pack('<H', 2),
+        entry(0x9003, 2, len(date_b), date_at),
+        struct.pack('<HHI', 0x9291, 2, len(subsec_b)) + subsec_b.ljust(4, b'\x00'),
+        struct.pack('<I', 0),
+        struct.pack('<H', 2),
+        entry(0x0201, 4, 1, thumb_at),
+        entry(0x0202, 4, 1, len(thumbnail)),
+        struct.pack('<I', 0),
+        model_b, date_b, thumbnail,
+        ])
+
+def InsertExif(jpeg, tiff):
+    """Insert an EXIF APP1 segment straight after the SOI marker."""
+    app1 = b'Exif\x00\x00' + tiff
+    return b''.join([
+        jpeg[:2], b'\xff\xe1', struct.pack('>H', len(app1) + 2), app1, jpeg[2:]])
+
+def MakeJpeg(size, seed, quality=90):
+    """A photograph-like JPEG: smooth gradients with fine noise, which
+    compresses to a realistic file size. Returns (jpeg bytes, thumbnail)."""
+    width, height = size
+    noise = Image.effect_noise(size, 40 + seed * 5)
+    red = Image.linear_gradient('L').resize(size)
+    green = noise.filter(ImageFilter.GaussianBlur(1))
+    blue = Image.radial_gradient('L').resize(size)
+    image = Image.merge('RGB', (red, green, blue))
+
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=quality)
+    thumb = io.BytesIO()
+    image.resize((160, 120)).save(thumb, 'JPEG', quality=75)
+    return out.getvalue(), thumb.getvalue()
+
+def MakeCard(root, count, size, per_folder=500, variants=4):
+    """Generate a DCF card of 'count' JPEGs under 'root'. A few distinct
+    images are encoded and given different EXIF data per file, shot 0.1s
+    apart like a burst."""
+    bases = [MakeJpeg(size, seed) for seed in range(variants)]
+    start = datetime(2020, 6, 1, 12, 0, 0)
+    for index in range(count):
+        folder = os.path.join(
+                root, 'DCIM', '{}BENCH'.format(100 + index // per_folder))
+        if index % per_folder == 0:
+            os.makedirs(folder, exist_ok=True)
+        jpeg, thumb = bases[index % variants]
+        cdt = start + timedelta(milliseconds=100 * index)
+        tiff = MakeExif(cdt, orientation=6 if index % 10 == 0 else 1,
+                thumbnail=thumb)
+        name = os.path.join(folder, 'IMG_{:04d}.JPG'.format(index % 10000))
+        with open(name, 'wb') as fp:
+            fp.write(InsertExif(jpeg, tiff))
+
+class Bench(object):
+    """Times benchmarks and writes their results as JSON lines."""
+
+    def __init__(self, output=None):
+        self.output = output
+
+    def emit(self, record):
+        line = json.dumps(record, sort_keys=True)
+        print(line)
+        if self.output:
+            with open(self.output, 'a') as fp:
+                fp.write(line + '\n')
+
+    def time(self, name, func, items=None, **extra):
+        """Time func(), emit the result and return what func returned.
+        'items' is the number of items processed, or a function giving it
+        from the result."""
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        record = dict(bench=name, seconds=round(seconds, 6))
+        if callable(items):
+            items = items(result)
+        if items is not None:
+            record['items'] = items
+            record['per_sec'] = round(items / seconds, 2) if seconds else None
+        record.update(extra)
+        self.emit(record)
+        return result
+
+def BenchScan(bench, card):
+    entries = bench.time('scan', lambda: list(ScanJpgFiles(card)), len)
+    return [entry.path for entry in entries]
+
+def BenchMetadata(bench, files, workdir):
+    bench.time('exif_read', lambda: [ReadExif(f) for f in files], len(files))
+
+    filename = os.path.join(workdir, 'bench.meta.db')
+    for name in ('metadata_index_cold', 'metadata_index_warm'):
+        index = MetadataIndex(filename)
+        bench.time(name, lambda: [index.get(f) for f in files], len(files))
+        index.close()
+
+def BenchDecode(bench, sample):
+    bench.time('decode_full', lambda: [DecodeImage(f) for f in sample],
+            len(sample))
+    bench.time('decode_preview',
+            lambda: [DecodeImage(f, fit=CANVAS_SIZE) for f in sample],
+            len(sample), canvas=list(CANVAS_SIZE))
+
+def BenchZoom(bench, image_path):
+    """Time each zoom level from invfrange, resampled from the full image as
+    ImageCanvas used to, and from the nearest larger level of a pyramid."""
+    full = DecodeImage(image_path)
+    width, height = full.size
+    min_scale = round(min(
+        float(CANVAS_SIZE[0]) / width, float(CANVAS_SIZE[1]) / height, 1.0), 4)
+    levels = {}
+    for scale in invfrange(1.0, min_scale, 0.2):
+        size = (int(width * scale), int(height * scale))
+        bench.time('zoom_direct', lambda: full.resize(size, Image.LANCZOS),
+                scale=scale)
+        source = NearestImage(list(levels.values()) + [full], size)
+        levels[scale] = bench.time('zoom_pyramid',
+                lambda: source.resize(size, Image.LANCZOS), scale=scale)
+
+def BenchCopy(bench, files, workdir, workers):
+    total = sum(os.path.getsize(f) for f in files)
+    for name, nworkers, verify in (
+            ('copy_serial', 1, True),
+            ('copy_pool', workers, True),
+            ('copy_pool_noverify', workers, False)):
+        destination = os.path.join(workdir, name)
+        os.makedirs(destination)
+        jobs = BuildCopyJobs(files, destination, NameOptions())
+        copier = BatchCopier(nworkers, verify=verify)
+        stats = bench.time(name, lambda: copier.copy(jobs), len(files),
+                workers=nworkers, verify=verify, bytes=total)
+        bench.emit(dict(bench=name + '_throughput',
+            mb_per_sec=round(stats.mb_per_sec(), 2),
+            files_per_sec=round(stats.files_per_sec(), 2),
+            errors=len(stats.errors)))
+        shutil.rmtree(destination)
+
+def BenchDerive(bench, files, workdir):
+    """Time making previews with one process and with one per core. The
+    previews directory is absolute, so nothing is written to the card."""
+    for name, workers in (('preview_1', 1), ('preview_pool', os.cpu_count())):
+        directory = os.path.join(workdir, name)
+
+        def run():
+            previews = DerivativePool(workers, directory=directory)
+            for image in files:
+                previews.submit(image)
+            previews.close()
+            return previews
+
+        bench.time(name, run, len(files), workers=workers)
+        shutil.rmtree(directory, ignore_errors=True)
+
+def BenchCatalog(bench, files, count=100000):
+    """Time cataloguing 'count' images, repeating the paths of 'files',
+    then sorting and filtering them. The capture times and cameras are made
+    up, as only the catalog is being timed."""
+    paths = [files[i % len(files)] for i in range(count)]
+
+    def build():
+        catalog = Catalog()
+        for number, path in enumerate(paths):
+            record = catalog.add(path, 1, number * 0.1)
+            catalog.camera[record] = catalog.intern(
+                    'Camera {}'.format(number % 3), catalog.cameras,
+                    catalog.camera_ids)
+        return catalog
+
+    catalog = bench.time('catalog_add', build, count)
+    for field in (SORT_TIME, SORT_CAMERA):
+        bench.time('catalog_sort_' + field,
+                lambda: catalog.show(catalog.sort_key(field)), count)
+    bench.time('catalog_filter',
+            lambda: catalog.show(None, catalog.same_camera(0)), count)
+
+STARTUP_CODE = """
+import os, ImageCopy
+ImageCopy.GetConfigFilename = lambda: {ini!r}
+ImageCopy.GetDataFilename = lambda name: os.path.join({workdir!r}, 'ImageCopy.' + name)
+try:
+    root = ImageCopy.Tk()
+except ImageCopy.TclError:
+    root = None
+if root is None:
+    config = ImageCopy.LoadConfigFile()
+    ImageCopy.MetadataIndex(ImageCopy.GetDataFilename('meta.db'))
+    ImageCopy.CopyJournal(ImageCopy.GetDataFilename('journal.db'))
+    ImageCopy.DuplicateIndex(ImageCopy.GetDataFilename('library.db'))
+    assert ImageCopy.LoadCatalog(
+            ImageCopy.GetDataFilename('scan.json'), config['DEFAULT']['source'])
+else:
+    control = ImageCopy.ImageCopyController(root)
+    root.update()
+    assert len(control.catalog)
+print(root is not None, flush=True)
+os._exit(0)
+"""
+
+def BenchStartup(bench, card, files, workdir):
+    """Time a cold start of ImageCopy in a new process, up to the point it
+    can show the last image viewed: importing it, building the controller
+    and its window, and loading the catalog saved by the last scan of the
+    card. Without a display the window is left out, and only the files the
+    controller opens are opened. The start of the interpreter is left out
+    too."""
+    catalog = Catalog()
+    for path in files:
+        st = os.stat(path)
+        catalog.add(path, st.st_size, st.st_ctime)
+    catalog.save(os.path.join(workdir, 'ImageCopy.scan.json'), card, 0)
+    ini = os.path.join(workdir, 'ImageCopy.ini')
+    config = configparser.ConfigParser()
+    config['DEFAULT'] = {
+            'source': card, 'destination': workdir, 'use_date': 'no',
+            'use_time': 'no', 'use_user': 'no', 'use_name': 'yes'}
+    with open(ini, 'w') as fp:
+        config.write(fp)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = STARTUP_CODE.format(ini=ini, workdir=workdir)
+    seconds = []
+    for argv in ([sys.executable, '-c', 'pass'], [sys.executable, '-c', code]):
+        start = time.perf_counter()
+        result = subprocess.run(
+                argv, cwd=here, check=True, stdout=subprocess.PIPE)
+        seconds.append(time.perf_counter() - start)
+    cold_start = seconds[1] - seconds[0]
+    bench.emit(dict(bench='cold_start', seconds=round(cold_start, 6),
+        items=len(files), target=COLD_START_TARGET,
+        met=cold_start <= COLD_START_TARGET,
+        window=result.stdout.strip() == b'True'))
+
+def BenchQuality(bench, files, workdir):
+    """Time scoring images with one process and with one per core, then
+    again from a warm QualityIndex."""
+    for name, workers in (('quality_1', 1), ('quality_pool', os.cpu_count())):
+        bench.time(name, lambda: ScoreImages(files, None, workers),
+                len(files), workers=workers)
+    index = QualityIndex(os.path.join(workdir, 'quality.db'))
+    ScoreImages(files, index)
+    bench.time('quality_cached', lambda: ScoreImages(files, index), len(files))
+    index.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--card', help="existing card to benchmark, "
+            "otherwise one is generated in a temporary directory")
+    parser.add_argument('--count', type=int, default=1000,
+            help="number of images to generate")
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--sample', type=int, default=10,
+            help="number of images to decode")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--output', help="file to append JSON results to")
+    parser.add_argument('--keep', action='store_true',
+            help="keep the generated card and copies")
+    args = parser.parse_args(argv)
+
+    bench = Bench(args.output)
+    workdir = tempfile.mkdtemp(prefix='ImageBench')
+    card = args.card or os.path.join(workdir, 'card')
+    bench.emit(dict(bench='run', time=datetime.now().isoformat(),
+        python=platform.python_version(), platform=platform.platform(),
+        card=card))
+    try:
+        if args.card is None:
+            bench.time('generate',
+                    lambda: MakeCard(card, args.count, (args.width, args.height)),
+                    args.count, size=[args.width, args.height])
+
+        files = BenchScan(bench, card)
+        if not files:
+            print("No JPG files found in {}".format(card), file=sys.stderr)
+            return 1
+        BenchMetadata(bench, files, workdir)
+        BenchDecode(bench, files[:args.sample])
+        BenchZoom(bench, files[0])
+        BenchCopy(bench, files, workdir, args.workers)
+        BenchDerive(bench, files[:args.sample * 10], workdir)
+        BenchQuality(bench, files[:args.sample * 10], workdir)
+        BenchCatalog(bench, files)
+        BenchStartup(bench, card, files, workdir)
+    finally:
+        if args.keep:
+            print("Kept {}".format(workdir), file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
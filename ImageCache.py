@@ -0,0 +1,191 @@
+"""Cache of decoded images, filled in the background around the image
+currently being viewed so stepping through a card does not wait on decode."""
+
+import io
+import threading
+from collections import OrderedDict
+from PIL import Image
+from ImageExif import ReadHeader
+from ImageStats import Timer
+
+DRAFT_FACTORS = (8, 4, 2)
+
+def DraftFactor(scale):
+    """Return the largest JPEG DCT reduction (8, 4 or 2) which still decodes
+    at least 'scale' of the full size, or 1 for a full size decode."""
+    for factor in DRAFT_FACTORS:
+        if 1.0 / factor >= scale:
+            return factor
+    return 1
+
+def DecodeImage(image_path, scale=1.0, fit=None):
+    """Open and decode an image ready for display.
+
+    JPEGs are decoded at 1/2, 1/4 or 1/8 size in the DCT domain when that is
+    still large enough to show the image at 'scale', or to fill the
+    (width, height) box 'fit' if given. Other formats decode at full size.
+    The file is read into memory first so disk time is timed apart from
+    decode time."""
+    with Timer('read'):
+        with open(image_path, 'rb') as fp:
+            data = fp.read()
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    if fit:
+        scale = min(float(fit[0]) / width, float(fit[1]) / height, 1.0)
+
+    factor = DraftFactor(scale)
+    with Timer('decode 1/{}'.format(factor)):
+        if factor > 1:
+            image.draft('RGB', (max(1, width // factor), max(1, height // factor)))
+        image.load()
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+    return image
+
+def ImageSize(image_path):
+    """The (width, height) of an image from its JPEG header, without reading
+    the rest of the file. Other formats are opened with PIL."""
+    with Timer('header'):
+        size = ReadHeader(image_path).size
+        if size is None:
+            with Image.open(image_path) as image:
+                size = image.size
+    return size
+
+def ImageBytes(image):
+    """Approximate memory used by a decoded image."""
+    width, height = image.size
+    return width * height * len(image.getbands())
+
+class DecodeCache(object):
+    """Bounded cache of decoded images keyed by image path.
+
+    Each entry remembers its index in the image list, so when the memory cap
+    is exceeded the entries furthest from the current cursor are evicted
+    first. Entries are kept in least recently used order, which breaks ties.
+    """
+
+    def __init__(self, max_mb=256):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.bytes = 0
+        self.cursor = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, image_path):
+        with self.lock:
+            return image_path in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, image_path):
+        """Return the decoded image, or None if it is not cached."""
+        with self.lock:
+            entry = self.entries.get(image_path)
+            if entry is None:
+                return None
+            self.entries.move_to_end(image_path)
+            return entry[1]
+
+    def put(self, image_path, index, image):
+        """Add a decoded image at position 'index' in the image list."""
+        nbytes = ImageBytes(image)
+        with self.lock:
+            old = self.entries.pop(image_path, None)
+            if old:
+                self.bytes -= ImageBytes(old[1])
+            self.entries[image_path] = (index, image)
+            self.bytes += nbytes
+            self._evict()
+
+    def set_cursor(self, index):
+        with self.lock:
+            self.cursor = index
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def _evict(self):
+        """Drop the entries furthest from the cursor until under the cap,
+        keeping at least one. The newest entry is dropped like any other if
+        it is furthest, e.g. a decode arriving after the cursor has moved
+        on; of entries as far, the least recently used goes first."""
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            victim = max(
+                    self.entries,
+                    key=lambda path: abs(self.entries[path][0] - self.cursor))
+            self.bytes -= ImageBytes(self.entries.pop(victim)[1])
+
+class Prefetcher(object):
+    """Background worker which decodes the images either side of the cursor
+    into a DecodeCache, nearest first."""
+
+    def __init__(self, cache, radius=2, decode=DecodeImage):
+        self.cache = cache
+        self.radius = radius
+        self.decode = decode
+        self.images = []
+        self.cursor = 0
+        self.generation = 0
+        self.running = True
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name='Prefetcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def set_cursor(self, images, index):
+        """Move the cursor to 'index' in the list 'images'. Any prefetch in
+        progress for the old position is abandoned."""
+        with self.cond:
+            if images is not self.images:
+                self.cache.clear()
+            self.images = images
+            self.cursor = index
+            self.generation += 1
+            self.cache.set_cursor(index)
+            self.cond.notify()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+    def wanted(self, images, cursor):
+        """Indexes to prefetch, nearest to the cursor first, next before
+        previous."""
+        order = []
+        for step in range(1, self.radius + 1):
+            for index in (cursor + step, cursor - step):
+                if 0 <= index < len(images):
+                    order.append(index)
+        return order
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if not self.running:
+                    return
+                generation = self.generation
+                images, cursor = self.images, self.cursor
+
+            for index in self.wanted(images, cursor):
+                if generation != self.generation or not self.running:
+                    break
+                image_path = images[index]
+                if image_path in self.cache:
+                    continue
+                try:
+                    image = self.decode(image_path)
+                except (IOError, OSError):
+                    continue
+                if generation == self.generation:
+                    self.cache.put(image_path, index, image)
+
+            with self.cond:
+                if generation == self.generation and self.running:
+                    self.cond.wait()
@@ -0,0 +1,315 @@
+"""A compact catalog of the images of a source, kept in memory.
+
+Each field of the images is a column, an array of machine numbers, rather
+than an object per image. The folder and camera of an image are numbers
+standing for one of the distinct folders and cameras seen, so only the file
+name is kept as a string of its own. 100,000 images take a few MB.
+
+Images are numbered in the order they were added, which never changes, so
+other lists such as the bursts and quality scores can be kept by image
+number. What the UI steps through is a CatalogView, the images in some sort
+order less any filtered out.
+
+A catalog can be saved when ImageCopy closes and loaded when it starts
+again, so the images of the last scan are shown before the source has been
+listed again."""
+
+import json
+import os
+from array import array
+from datetime import datetime, timedelta
+
+SELECTED = 1
+COPIED = 2
+
+SORT_NAME = 'name'          # The order the images were found in.
+SORT_TIME = 'time'
+SORT_CAMERA = 'camera'
+
+SAVE_VERSION = 1
+COLUMNS = ('folder', 'size', 'time', 'width', 'height', 'orientation', 'camera')
+
+class Catalog(object):
+    """The images found in a source and what is known of each: file size,
+    capture time, (width, height), EXIF orientation, camera, and whether it
+    is selected or has been copied. Unknown dimensions are 0, an unknown
+    orientation 0 and an unknown camera ''.
+
+    Images may only be added from one thread, normally the Tk thread."""
+
+    def __init__(self):
+        self.folders = []       # Distinct folders, numbered in 'folder'.
+        self.folder_ids = {}
+        self.cameras = ['']     # Distinct camera models, numbered in 'camera'.
+        self.camera_ids = {'': 0}
+        self.names = []
+        self.folder = array('I')
+        self.size = array('q')
+        self.time = array('d')  # Seconds since the epoch, as CaptureTime.
+        self.width = array('I')
+        self.height = array('I')
+        self.orientation = array('B')
+        self.camera = array('H')
+        self.flags = array('B')
+        self.selected_count = 0
+        self.view = CatalogView(self, array('I'))
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, value, values, ids):
+        """Number of 'value' in the list 'values', adding it if new."""
+        number = ids.get(value)
+        if number is None:
+            number = ids[value] = len(values)
+            values.append(value)
+        return number
+
+    def add(self, path, size=0, ctime=0.0):
+        """Add an image and return its number. Until its EXIF data is set
+        its capture time is the creation time of the file, as CaptureTime."""
+        folder, name = os.path.split(path)
+        self.folder.append(self.intern(folder, self.folders, self.folder_ids))
+        self.names.append(name)
+        self.size.append(size)
+        self.time.append(ctime)
+        self.width.append(0)
+        self.height.append(0)
+        self.orientation.append(0)
+        self.camera.append(0)
+        self.flags.append(0)
+        record = len(self.names) - 1
+        self.view.added(record)
+        return record
+
+    def add_entries(self, entries):
+        """Add a list of os.DirEntry from ImageScan, whose stat results are
+        already cached."""
+        for entry in entries:
+            st = entry.stat()
+            self.add(entry.path, st.st_size, st.st_ctime)
+
+    def path(self, record):
+        return os.path.join(self.folders[self.folder[record]], self.names[record])
+
+    def paths(self):
+        """The paths of all the images, by image number."""
+        return [self.path(record) for record in range(len(self.names))]
+
+    def set_exif(self, record, info):
+        """Fill in the capture time, camera and orientation from ExifInfo."""
+        cdt = info.capture_time()
+        if cdt is not None:
+            self.time[record] = cdt.timestamp()
+        self.camera[record] = self.intern(
+                info.model or '', self.cameras, self.camera_ids)
+        self.orientation[record] = info.orientation or 0
+
+    def set_dimensions(self, record, size):
+        self.width[record], self.height[record] = size
+
+    def camera_of(self, record):
+        return self.cameras[self.camera[record]]
+
+    def set_flag(self, record, flag, on=True):
+        old = self.flags[record]
+        new = old | flag if on else old & ~flag
+        if (old ^ new) & SELECTED:
+            self.selected_count += 1 if on else -1
+        self.flags[record] = new
+
+    def has_flag(self, record, flag):
+        return bool(self.flags[record] & flag)
+
+    def select(self, records):
+        """Select images by number, whether in the view or not."""
+        for record in records:
+            self.set_flag(record, SELECTED)
+
+    def sort_key(self, field):
+        """Function of an image number giving its sort key for SORT_NAME,
+        SORT_TIME or SORT_CAMERA, or None for the order found."""
+        if field == SORT_TIME:
+            return self.time.__getitem__
+        if field == SORT_CAMERA:
+            cameras, camera, time = self.cameras, self.camera, self.time
+            return lambda record: (cameras[camera[record]], time[record])
+        return None
+
+    def same_camera(self, record):
+        """Filter keeping the images taken with the same camera as 'record'."""
+        camera, number = self.camera, self.camera[record]
+        return lambda other: camera[other] == number
+
+    def same_day(self, record):
+        """Filter keeping the images taken on the same day as 'record'."""
+        day = datetime.fromtimestamp(self.time[record]).replace(
+                hour=0, minute=0, second=0, microsecond=0)
+        start = day.timestamp()
+        end = (day + timedelta(days=1)).timestamp()
+        time = self.time
+        return lambda other: start <= time[other] < end
+
+    def not_copied(self):
+        """Filter keeping the images not yet copied."""
+        flags = self.flags
+        return lambda other: not flags[other] & COPIED
+
+    def show(self, key=None, keep=None):
+        """Make and return a new view of the images for which keep(number) is
+        true, sorted by key(number). The sort is stable, so images with the
+        same key stay in the order found."""
+        records = range(len(self.names))
+        if keep is not None:
+            records = filter(keep, records)
+        if key is not None:
+            records = sorted(records, key=key)
+        self.view = CatalogView(self, array('I', records), key, keep)
+        return self.view
+
+    def save(self, filename, source, current=None):
+        """Write the catalog to 'filename' as JSON, with the 'source' it was
+        scanned from and the image number 'current' being looked at. Whether
+        each image has been copied is kept, the selection is not."""
+        state = dict(
+                version=SAVE_VERSION, source=source, current=current,
+                folders=self.folders, cameras=self.cameras, names=self.names,
+                copied=[record for record, flags in enumerate(self.flags)
+                    if flags & COPIED])
+        for column in COLUMNS:
+            state[column] = getattr(self, column).tolist()
+        temp = '{}.tmp'.format(filename)
+        with open(temp, 'w') as fp:
+            json.dump(state, fp, separators=(',', ':'))
+        os.replace(temp, filename)
+
+def LoadCatalog(filename, source):
+    """Return (Catalog, image number last looked at or None) as saved by
+    Catalog.save for 'source', or None if none was saved for it or the file
+    cannot be read."""
+    try:
+        with open(filename) as fp:
+            state = json.load(fp)
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(state, dict) or state.get('version') != SAVE_VERSION \
+            or state.get('source') != source:
+        return None
+
+    catalog = Catalog()
+    try:
+        catalog.folders = list(state['folders'])
+        catalog.folder_ids = dict(
+                (folder, number) for number, folder in enumerate(catalog.folders))
+        catalog.cameras = list(state['cameras'])
+        catalog.camera_ids = dict(
+                (camera, number) for number, camera in enumerate(catalog.cameras))
+        catalog.names = list(state['names'])
+        count = len(catalog.names)
+        for column in COLUMNS:
+            getattr(catalog, column).fromlist(state[column])
+            if len(getattr(catalog, column)) != count:
+                return None
+        catalog.flags = array('B', bytes(count))
+        for record in state['copied']:
+            catalog.flags[record] = COPIED
+        current = state.get('current')
+    except (KeyError, TypeError, ValueError, IndexError, OverflowError):
+        return None
+    catalog.view = CatalogView(catalog, array('I', range(count)))
+    if not isinstance(current, int) or not 0 <= current < count:
+        current = None
+    return catalog, current
+
+class CatalogView(object):
+    """The paths of some of the images of a Catalog in a given order, as a
+    read only sequence. Images added to the catalog are added at the end of
+    the view if they pass its filter, so a view being shown never shrinks
+    and may be handed to other threads; sorting or filtering makes a new
+    view."""
+
+    def __init__(self, catalog, order, key=None, keep=None):
+        self.catalog = catalog
+        self.order = order      # Image number at each position.
+        self.key = key
+        self.keep = keep
+        self.positions = None   # Position of each image number, once needed.
+        self.selected = Selection(self)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, position):
+        return self.catalog.path(self.order[position])
+
+    def __iter__(self):
+        for record in self.order:
+            yield self.catalog.path(record)
+
+    def added(self, record):
+        if self.keep is None or self.keep(record):
+            self.order.append(record)
+            if self.positions is not None:
+                self.positions.append(len(self.order) - 1)
+        elif self.positions is not None:
+            self.positions.append(-1)
+
+    def record(self, position):
+        """The image number at 'position'."""
+        return self.order[position]
+
+    def position(self, record):
+        """The position of image number 'record' in the view, or -1 if it has
+        been filtered out."""
+        if self.positions is None:
+            self.positions = array('i', [-1]) * len(self.catalog)
+            for position, number in enumerate(self.order):
+                self.positions[number] = position
+        return self.positions[record]
+
+class Selection(object):
+    """The positions of the selected images of a CatalogView, as a set. The
+    selection is kept in the Catalog so it survives sorting and filtering."""
+
+    def __init__(self, view):
+        self.view = view
+
+    def __contains__(self, position):
+        order = self.view.order
+        return 0 <= position < len(order) and \
+                self.view.catalog.has_flag(order[position], SELECTED)
+
+    def __iter__(self):
+        flags = self.view.catalog.flags
+        for position, record in enumerate(self.view.order):
+            if flags[record] & SELECTED:
+                yield position
+
+    def __len__(self):
+        if len(self.view.order) == len(self.view.catalog):
+            return self.view.catalog.selected_count
+        return sum(1 for position in self)
+
+    def add(self, position):
+        self.view.catalog.set_flag(self.view.order[position], SELECTED)
+
+    def discard(self, position):
+        if 0 <= position < len(self.view.order):
+            self.view.catalog.set_flag(
+                    self.view.order[position], SELECTED, False)
+
+    def update(self, positions):
+        for position in positions:
+            self.add(position)
+
+    def symmetric_difference_update(self, positions):
+        for position in positions:
+            record = self.view.order[position]
+            self.view.catalog.set_flag(
+                    record, SELECTED,
+                    not self.view.catalog.has_flag(record, SELECTED))
+
+    def clear(self):
+        """Deselect the images in the view."""
+        for position in list(self):
+            self.discard(position)
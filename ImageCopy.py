@@ -12,8 +12,9 @@ __all__ = ['__version__', '__author__']
 
 import os
 import configparser
-import glob
+import shutil
 import sys
+from functools import partial
 if sys.version_info[0] > 2:
     import tkinter.font as tkFont
     from tkinter import *
@@ -21,10 +22,21 @@ if sys.version_info[0] > 2:
 else:
     import tkFont
     from Tkinter import *
-from PIL import Image, ImageTk
 from ImageScale import ImageCanvas
-from datetime import datetime
-from shutil import copyfile
+from ImageBatch import BatchCopier, BuildCopyJobs, BuildCopyName, CopyFile, \
+        NameOptions
+from ImageCatalog import COPIED, Catalog, LoadCatalog, SELECTED, \
+        SORT_CAMERA, SORT_NAME, SORT_TIME
+from ImageCache import DecodeCache, DecodeImage, ImageSize, Prefetcher
+from ImageDupes import DuplicateIndex
+from ImageExif import CaptureTime, MetadataIndex
+from ImageIngest import BuildIngestJobs, IngestScheduler
+from ImageJournal import CopyJournal, SourceKey
+from ImageOrient import OrientImage, OrientedSize, RotateCopied, UPRIGHT
+from ImageScan import ScanJpgFiles, ScanJpgFolders
+from ImageStats import STATS, Timer
+from ImageTasks import TaskRunner
+from ImageThumbs import ThumbnailCache, ThumbnailGrid
 
 def GetConfigFilename():
     """Return the config file name based on the following rules:
@@ -38,6 +50,15 @@ def GetConfigFilename():
             '.'.join([thisfile, 'ini'])
             )
     
+def GetDataFilename(name):
+    """Return the name of a data file kept alongside the config file, e.g.
+    GetDataFilename('meta.db') is 'ImageCopy.meta.db' in the same directory.
+    """
+    thisfile = os.path.splitext(
+            os.path.abspath(__file__)
+            )[0]
+    return '.'.join([thisfile, name])
+
 def UpdateConfigFile(config):
     """Update the Config File by writing it."""
     with open(GetConfigFilename(), 'w') as cf:
@@ -59,6 +80,17 @@ def LoadConfigFile():
                 'use_user': 'no',
                 'use_name': 'yes',
                 'descr': 'Example1,Example2',
+                'workers': '4',
+                'cache_mb': '256',
+                'prefetch': '2',
+                'skip_duplicates': 'yes',
+                'verify': 'yes',
+                'buffer_kb': '4096',
+                'watch_roots': '',
+                'watch_interval': '2',
+                'previews': 'no',
+                'preview_size': '1600x1200',
+                'rotate_copies': 'no',
                 }
 
         UpdateConfigFile(config)
@@ -66,11 +98,31 @@ def LoadConfigFile():
     return config
 
 def ListJpgFiles(path):
-    """return a list of all files with the .jpg extension in the path passed."""
-    jpgfiles = glob.glob(
-            os.path.join(path, '*.jpg')
-            )
-    return jpgfiles
+    """return a list of all files with the .jpg extension in the path passed,
+    including those in the DCF folders under its DCIM folder."""
+    return [entry.path for entry in ScanJpgFiles(path)]
+
+def Previews(config):
+    """A DerivativePool to make previews of the images copied, or None if
+    previews are turned off in the config."""
+    if not config.getboolean('DEFAULT', 'previews', fallback=False):
+        return None
+    from ImageDerive import DerivativePool, ParseSize
+    return DerivativePool(size=ParseSize(
+        config.get('DEFAULT', 'preview_size', fallback='1600x1200')))
+
+def WindowKey(event):
+    """True if a key bound on the window is meant for it, rather than for
+    a widget which handles the key itself: an Entry being typed in, or a
+    focused Button, Checkbutton or Listbox."""
+    return event is None or not isinstance(
+            event.widget, (Entry, Button, Checkbutton, Listbox))
+
+def WatchRoots(config):
+    """The folders to watch for cards from the config, or None for the
+    usual mount folders of the platform."""
+    roots = config.get('DEFAULT', 'watch_roots', fallback='')
+    return [root.strip() for root in roots.split(',') if root.strip()] or None
 
 class ImageCopyController(object):
     """ImageCopy Controller Class"""
@@ -87,31 +139,85 @@ class ImageCopyController(object):
         self.time_str = StringVar()
         self.fn_str = StringVar()
         self.fnum_str = StringVar()
+        self.sel_str = StringVar()
+        self.burst_str = StringVar()
+        self.quality_str = StringVar()
+        self.perf_str = StringVar()
+        self.ingest_str = StringVar()
         self.chosen = StringVar()
+        self.sort_by = StringVar()
+        self.show_only = StringVar()
 
         self.cb_date = IntVar()
         self.cb_time = IntVar()
         self.cb_name = IntVar()
         self.cb_user = IntVar()
+        self.cb_selected = IntVar()
+        self.cb_perf = IntVar()
+        self.cb_watch = IntVar()
+        self.cb_rotate = IntVar()
 
         # Get defaults from Config file, or set them!
         self.config = LoadConfigFile()
-        self.jpgfiles = ListJpgFiles(self.config['DEFAULT']['source'])
-        self.jpgidx = 0     # Index on first image in the list.
-        self.jpglen = len(self.jpgfiles)
+        self.metadata = MetadataIndex(GetDataFilename('meta.db'))
+        self.journal = CopyJournal(GetDataFilename('journal.db'))
+        self.dupes = DuplicateIndex(GetDataFilename('library.db'))
+        self.quality = None     # QualityIndex, opened when first scored.
+        self.dupes_dir = None   # Destination the library index was refreshed for.
+        self.thumbs = ThumbnailCache(GetDataFilename('thumbs'))
+        self.cdt = None     # Capture time of the current image.
+        self.catalog = Catalog()        # Every image found in the source.
+        self.view = self.catalog.view   # The images shown, in order.
+        self.jpgidx = 0     # Position of the current image in the view.
+        self.scan = None    # Folders of the source still to be listed.
+        self.scan_catalog = None    # Catalog the scan is adding to.
+        self.sel_mark = 0       # Where a range selection starts from.
+        self.grid = None        # Contact sheet, if open.
+        self.bursts = None      # Bursts of the images, once found.
+        self.bursts_len = 0     # Number of images the bursts were found for.
+        self.scores = None      # Quality of each image number, once scored.
+        self.sort_by.set(SORT_NAME)
+        self.show_only.set('all')
+        self.watcher = None     # CardWatcher while watching for cards.
+        self.ingests = []       # IngestSchedulers queued or copying.
+        self.ingest_job = None  # Update of the ingest progress due.
         self.cb_date.set(self.config.getboolean('DEFAULT','use_date'))
         self.cb_time.set(self.config.getboolean('DEFAULT','use_time'))
         self.cb_user.set(self.config.getboolean('DEFAULT','use_user'))
         self.cb_name.set(self.config.getboolean('DEFAULT','use_name'))
+        self.cb_rotate.set(self.config.getboolean(
+            'DEFAULT', 'rotate_copies', fallback=False))
+
+        # Decoded images either side of the current one, filled in the
+        # background.
+        self.cache = DecodeCache(
+                self.config.getint('DEFAULT', 'cache_mb', fallback=256))
+        self.prefetch = Prefetcher(
+                self.cache,
+                self.config.getint('DEFAULT', 'prefetch', fallback=2),
+                self.decode_preview)
+
+        # Slow work is done off the Tk thread: browsing on one runner, and
+        # copies one at a time on another so they never hold up browsing,
+        # nor do analyses of the whole card on a third.
+        self.tasks = TaskRunner(self.root, 2, 'Browse')
+        self.copies = TaskRunner(self.root, 1, 'Copy')
+        self.analysis = TaskRunner(self.root, 1, 'Analysis')
+        self.watch_tasks = TaskRunner(self.root, 1, 'Watch')
 
         self.root.bind('<Destroy>', self.destroy_cmd)
+        self.root.bind('<space>', self.toggle_select_cmd)
+        self.root.bind('<Shift-space>', self.select_range_cmd)
+        self.root.bind('<Next>', self.next_burst_cmd)
+        self.root.bind('<Prior>', self.prev_burst_cmd)
+        self.root.bind('b', self.next_borderline_cmd)
 
         self.MenuBar()                             
 
         left_frm = Frame(self.root)
         left_frm.pack(side=LEFT, fill=BOTH, expand=YES)
 
-        self.ic = ImageCanvas(left_frm)
+        self.ic = ImageCanvas(left_frm, self.tasks)
         self.button_frame(left_frm)
         self.source_frame(left_frm)
         self.destination_frame(left_frm)
@@ -119,20 +225,309 @@ class ImageCopyController(object):
         right_frm = Frame(self.root)
         right_frm.pack(side=RIGHT, fill=Y, expand=NO)
 
-        self.file_info_frame(right_frm)
+        info_frm = self.file_info_frame(right_frm)
         self.image_options_frame(right_frm)
         self.user_input_frame(right_frm)
+        self.performance_frame(right_frm, info_frm)
+        self.ingest_frame(right_frm)
 
         #root.state('zoomed')
 
-        if self.jpgfiles:
-            self.update_image_source()
+        # Wait for the window to be drawn before looking at the source.
+        self.root.after_idle(self.restore_scan)
                     
+    def library(self):
+        """The DuplicateIndex of the destination, refreshed the first time it
+        is used for each destination. None if duplicates are not skipped."""
+        if not self.config.getboolean(
+                'DEFAULT', 'skip_duplicates', fallback=True):
+            return None
+        destination = self.config['DEFAULT']['destination']
+        if self.dupes_dir != destination:
+            self.dupes.refresh(destination)
+            self.dupes_dir = destination
+        return self.dupes
+
+    def copy_options(self):
+        """The (verify, buffer_size) options for CopyFile from the config."""
+        return (
+                self.config.getboolean('DEFAULT', 'verify', fallback=True),
+                1024 * self.config.getint('DEFAULT', 'buffer_kb', fallback=4096))
+
     def copy_file_cmd(self):
-        copyfile(self.src_str.get(), self.dst_str.get())
+        """Copy the current image, first checking in the background whether
+        it is already in the destination."""
+        src = self.src_str.get()
+        if not self.dst_str.get():
+            return      # The image is still loading.
+        done = partial(
+                self.mark_copied, self.catalog, [self.view.record(self.jpgidx)])
+        self.copies.submit(
+                None, self.find_duplicate, (src,),
+                partial(
+                    self.copy_checked, src,
+                    self.config['DEFAULT']['destination'],
+                    self.name_options(), done),
+                partial(self.copy_failed, src))
+
+    def find_duplicate(self, src):
+        """The library file with the same contents as 'src', or None. Runs
+        on a worker thread."""
+        dupes = self.library()
+        if dupes is None:
+            return None
+        return dupes.find(src)
+
+    def copy_checked(self, src, destination, options, done, duplicate):
+        if duplicate and not messagebox.askyesno(
+                "Already copied",
+                '\n'.join([
+                    "This image is already in the destination as:",
+                    duplicate, "", "Copy it again?"])):
+            return
+        self.copies.submit(
+                None, self.copy_file, (src, destination, options), done,
+                partial(self.copy_failed, src))
+
+    def copy_file(self, src, destination, options):
+        """Copy one image to 'destination', recording it in the journal and
+        library. It is named as by Copy All Images, so a name already taken,
+        e.g. by another shot in the same second, is given a suffix. Returns
+        the path of the copy. Runs on a worker thread."""
+        job = BuildCopyJobs(
+                [src], destination, options, self.metadata, self.journal)[0]
+        resume = self.journal.is_partial(job.key, job.destination)
+        self.journal.start(job.key, src, job.destination)
+        with Timer('copy'):
+            size, digest = CopyFile(
+                    src, job.destination, resume, *self.copy_options())
+        self.journal.record(job.key, src, job.destination, size, digest)
+        dupes = self.library()
+        if dupes is not None:
+            dupes.add(job.destination, size, digest)
+        return job.destination
+
+    def copy_failed(self, src, error):
+        messagebox.showerror(
+                "Copy failed", '\n'.join([src, "", str(error)]))
+
+    def copy_all_cmd(self):
+        """Copy every image shown using the current destination name
+        options."""
+        self.copy_images(list(self.view.order), "Copy All Images")
+
+    def copy_selected_cmd(self):
+        """Copy the selected images in one batch."""
+        self.copy_images(
+                [self.view.record(i) for i in sorted(self.view.selected)],
+                "Copy Selected Images")
+
+    def copy_images(self, records, title):
+        """Copy a list of image numbers of the catalog."""
+        if not records:
+            return
+
+        self.copies.submit(
+                None, self.copy_batch,
+                ([self.catalog.path(record) for record in records],
+                    self.config['DEFAULT']['destination'],
+                    self.name_options()),
+                partial(self.batch_copied, self.catalog, records, title),
+                partial(self.copy_failed, title))
+
+    def batch_copied(self, catalog, records, title, result):
+        """Mark the images copied by copy_batch and report on them."""
+        message, failed = result
+        self.mark_copied(catalog, [
+            record for record in records if catalog.path(record) not in failed])
+        messagebox.showinfo(title, message)
+
+    def mark_copied(self, catalog, records, result=None):
+        for record in records:
+            catalog.set_flag(record, COPIED)
+        if catalog is self.catalog and len(self.view):
+            self.update_file_number()
+
+    def copy_batch(self, images, destination, options):
+        """Copy 'images' to 'destination'. Returns a message with the
+        CopyStats and the set of the images which failed. Runs on a worker
+        thread."""
+        jobs = BuildCopyJobs(
+                images, destination, options, self.metadata, self.journal)
+        previews = Previews(self.config)
+        copier = BatchCopier(
+                self.config.getint('DEFAULT', 'workers', fallback=4),
+                None,
+                self.journal,
+                self.library(),
+                *self.copy_options(),
+                derive=previews.copied if previews else None,
+                rewrite=self.rewrite())
+        stats = copier.copy(jobs)
+        failed = set(job.source for job, error in stats.errors)
+        if previews is None:
+            return str(stats), failed
+        previews.close()
+        return '\n'.join([str(stats), str(previews)]), failed
+
+    def rewrite(self):
+        """The rewrite hook for the copiers, turning copies upright if the
+        config file says so."""
+        if self.config.getboolean('DEFAULT', 'rotate_copies', fallback=False):
+            return RotateCopied
+        return None
+
+    def rotate_cmd(self):
+        """Remember whether copies are turned upright as they are made."""
+        self.config['DEFAULT']['rotate_copies'] = \
+                'yes' if self.cb_rotate.get() else 'no'
+        if self.cb_rotate.get() and not shutil.which('jpegtran'):
+            messagebox.showwarning(
+                    "Turn Copies Upright",
+                    "jpegtran was not found, so copies will be left as "
+                    "they are.")
+
+    def watch_cmd(self):
+        """Start or stop watching for cards. Watching stops once the wait in
+        progress, if any, is over."""
+        if self.cb_watch.get() and self.watcher is None:
+            from ImageWatch import CardWatcher
+            self.watcher = CardWatcher(
+                    WatchRoots(self.config),
+                    self.config.getfloat('DEFAULT', 'watch_interval', fallback=2))
+            self.watch_step()
+
+    def watch_step(self):
+        self.watch_tasks.submit(
+                None, self.watcher.wait, (), self.cards_found,
+                self.watch_failed)
+
+    def cards_found(self, cards):
+        """Show the last card inserted, and queue the images on each card
+        which have not been copied before."""
+        if not self.cb_watch.get():
+            self.watcher.close()
+            self.watcher = None
+            return
+        if cards:
+            self.ingest_cards(cards)
+        if cards and cards[-1] != self.config['DEFAULT']['source']:
+            self.config['DEFAULT']['source'] = cards[-1]
+            self.start_scan(warn=False)
+        self.watch_step()
+
+    def watch_failed(self, error):
+        self.watcher.close()
+        self.watcher = None
+        self.cb_watch.set(0)
+        messagebox.showerror("Watch for cards", str(error))
+
+    def ingest_all_cmd(self):
+        """Copy the new images on every card mounted."""
+        from ImageWatch import FindCards, MountRoots
+        cards = sorted(FindCards(WatchRoots(self.config) or MountRoots()))
+        if not cards:
+            messagebox.showwarning(
+                    "No cards found",
+                    "No mounted volume with a DCIM folder was found.")
+            return
+        self.ingest_cards(cards)
+
+    def ingest_cards(self, cards):
+        """Copy the new images on the cards, reading the cards in parallel
+        when they are on different devices."""
+        scheduler = IngestScheduler(
+                self.config.getint('DEFAULT', 'workers', fallback=4),
+                None, self.journal, None, *self.copy_options())
+        self.ingests.append(scheduler)
+        self.copies.submit(
+                None, self.ingest,
+                (scheduler, cards, self.config['DEFAULT']['destination'],
+                    self.name_options()),
+                partial(self.ingest_done, scheduler),
+                partial(self.ingest_failed, scheduler))
+        if self.ingest_job is None:
+            self.ingest_frm.pack(side=TOP, fill=X, expand=NO)
+            self.update_ingest()
+
+    def ingest(self, scheduler, cards, destination, options):
+        """Copy the images on the cards which have not been copied before,
+        returning the progress summary or None if there were none. Runs on
+        a worker thread."""
+        from ImageWatch import NewImages
+        sources = [(card, NewImages(card, self.journal)) for card in cards]
+        sources = [(card, images) for card, images in sources if images]
+        if not sources:
+            return None
+        scheduler.dupes = self.library()
+        previews = Previews(self.config)
+        if previews is not None:
+            scheduler.derive = previews.copied
+        scheduler.rewrite = self.rewrite()
+        scheduler.copy(BuildIngestJobs(
+            sources, destination, options, self.metadata, self.journal))
+        self.metadata.flush()
+        summary = scheduler.summary()
+        if previews is not None:
+            previews.close()
+            summary.append(str(previews))
+        return '\n'.join(summary)
+
+    def ingest_done(self, scheduler, summary):
+        self.ingests.remove(scheduler)
+        if summary is not None:
+            messagebox.showinfo("Cards ingested", summary)
+
+    def ingest_failed(self, scheduler, error):
+        self.ingests.remove(scheduler)
+        messagebox.showerror("Ingest failed", str(error))
+
+    def update_ingest(self):
+        """Show the progress of each card being ingested and the total,
+        twice a second until all are done."""
+        if not self.ingests:
+            self.ingest_job = None
+            self.ingest_frm.pack_forget()
+            return
+        lines = []
+        for scheduler in self.ingests:
+            lines.extend(scheduler.summary() if scheduler.sources else
+                    ["Waiting..."])
+        self.ingest_str.set('\n'.join(lines))
+        self.ingest_job = self.root.after(500, self.update_ingest)
+
+    def ingest_frame(self, parent):
+        """Frame showing the progress of ingesting cards, packed while
+        there are any."""
+        self.ingest_frm = Frame(parent, relief=RIDGE, bd=5)
+
+        title = Label(
+                self.ingest_frm, text="Ingest", width=30,
+                justify=CENTER, pady=5, padx=5)
+        title.pack(side=TOP, fill=X, expand=NO)
+
+        info = Label(
+                self.ingest_frm, textvariable=self.ingest_str, bg='black',
+                fg='white', anchor=W, justify=LEFT, wraplength=300)
+        info.pack(side=TOP, fill=X, expand=NO)
 
     def destroy_cmd(self, event):
         """What happens when the app is closed down."""
+        if event.widget is not self.root:
+            return
+        self.tasks.stop()
+        self.copies.stop()
+        self.analysis.stop()
+        self.watch_tasks.stop()
+        self.prefetch.stop()
+        self.metadata.close()
+        self.journal.close()
+        self.dupes.close()
+        if self.quality is not None:
+            self.quality.close()
+        self.catalog.save(
+                GetDataFilename('scan.json'), self.config['DEFAULT']['source'],
+                self.current_record())
         self.config['DEFAULT']['descr'] = ','.join(self.usr_descr)
         UpdateConfigFile(self.config)
 
@@ -149,49 +544,329 @@ class ImageCopyController(object):
         self.config['DEFAULT']['use_user'] = 'yes' if self.cb_user.get() else 'no'
         self.config['DEFAULT']['use_name'] = 'yes' if self.cb_name.get() else 'no'
 
+    def name_options(self):
+        """The destination NameOptions from the check boxes."""
+        return NameOptions(
+                self.cb_date.get(),
+                self.cb_time.get(),
+                self.chosen.get() if self.cb_user.get() else '',
+                self.cb_name.get())
+
     def update_destination(self):
         """Update the destination file name."""
-        image =self.jpgfiles[self.jpgidx]
-        cdt = datetime.fromtimestamp(os.path.getctime(image))
-        self.date_str.set(cdt.strftime('%Y-%m-%d'))
-        self.time_str.set(cdt.strftime('%H:%M:%S'))
-
-        cfn = list()
-        if self.cb_date.get():
-            cfn.append(cdt.strftime('%Y%m%d'))
-        if self.cb_time.get():
-            cfn.append(cdt.strftime('%H%M%S'))
-        ud = self.chosen.get()
-        if len(ud) and self.cb_user.get():
-            cfn.append(ud)
-        if self.cb_name.get():
-            cfn.append(self.fn_str.get())
-
-        copy_name = os.path.join(
+        self.usr_descr = self.listbox.get(0, END)
+        if self.cdt is None:
+            return      # No image, or its capture time is still loading.
+        image =self.view[self.jpgidx]
+        copy_name = BuildCopyName(
+                image,
                 self.config['DEFAULT']['Destination'],
-                "{}.jpg".format('_'.join(cfn)))
+                self.cdt,
+                self.name_options())
         self.dst_str.set(copy_name)
-        self.usr_descr = self.listbox.get(0, END)
 
     def update_image_source(self):
-        image =self.jpgfiles[self.jpgidx]
+        image =self.view[self.jpgidx]
 
         self.src_str.set(image)
         self.fn_str.set(os.path.basename(image))
-        self.fnum_str.set("{} of {}".format(self.jpgidx+1, self.jpglen))
-    
-        self.ic.load_image(image)
+        self.update_file_number()
+        self.cb_selected.set(self.jpgidx in self.view.selected)
+        self.update_burst()
+        self.update_quality()
+
+        # The rest waits for the image to be read, replacing any image
+        # still being read for an earlier press of Next or Prev.
+        self.cdt = None
+        self.date_str.set('')
+        self.time_str.set('')
+        self.dst_str.set('')
+        self.prefetch.set_cursor(self.view, self.jpgidx)
+        self.tasks.submit(
+                'image', self.read_image,
+                (image, self.jpgidx, self.ic.canvas_size),
+                partial(self.image_read, image, self.jpgidx),
+                partial(self.image_failed, image, self.jpgidx))
+
+    def update_file_number(self):
+        """Show where the current image is in the view, and if it has been
+        copied."""
+        number = "{} of {}".format(self.jpgidx+1, len(self.view))
+        if self.catalog.has_flag(self.view.record(self.jpgidx), COPIED):
+            number += ", copied"
+        self.fnum_str.set(number)
+
+    def read_image(self, image, index, fit):
+        """Return the capture time, full size as stored, orientation and an
+        upright decode fitting 'fit' of an image. Runs on a worker thread."""
+        with Timer('metadata'):
+            cdt = CaptureTime(image, self.metadata)
+            orientation = self.metadata.get(image).orientation or UPRIGHT
+        size = ImageSize(image)
+        decoded = self.cache.get(image)
+        if decoded is None:
+            STATS.incr('cache miss')
+            decoded = self.decode_preview(image, orientation, fit)
+            self.cache.put(image, index, decoded)
+        else:
+            STATS.incr('cache hit')
+        return cdt, size, orientation, decoded
+
+    def image_read(self, image, index, result):
+        """Show an image once read_image is done with it."""
+        if index >= len(self.view) or self.view[index] != image:
+            return      # The source has been scanned or sorted again since.
+        self.cdt, size, orientation, decoded = result
+        self.catalog.set_dimensions(self.view.record(index), size)
+        self.date_str.set(self.cdt.strftime('%Y-%m-%d'))
+        self.time_str.set(self.cdt.strftime('%H:%M:%S'))
+
+        with Timer('show image'):
+            self.ic.load_image(image, decoded, size, orientation)
         self.zoom_str.set("{:d} %".format(self.ic.get_zoom()))
         self.update_destination()
 
+    def image_failed(self, image, index, error):
+        """Say which image could not be read, e.g. one gone from a card
+        which is no longer in the reader, and show no image."""
+        if index >= len(self.view) or self.view[index] != image:
+            return
+        self.ic.unload_image()
+        self.zoom_str.set('')
+        self.update_destination()
+        messagebox.showerror(
+                "Cannot read image", '\n'.join([image, "", str(error)]))
+
+    def decode_preview(self, image, orientation=None, fit=None):
+        """Decode an image just large enough to fit the canvas, or 'fit', and
+        turn it upright. The decodes cached are all upright, so an image is
+        only turned once however often it is shown."""
+        if orientation is None:
+            orientation = self.metadata.get(image).orientation or UPRIGHT
+        decoded = DecodeImage(
+                image, fit=OrientedSize(fit or self.ic.canvas_size, orientation))
+        return OrientImage(decoded, orientation)
+
+    def goto_image(self, index):
+        """Show the image at 'index' in the list."""
+        if 0 <= index < len(self.view):
+            self.jpgidx = index
+            self.update_image_source()
+
+    def goto_record(self, record, step):
+        """Show image number 'record', or if it is not in the view the one
+        step(record) gives, and so on. step returns None when there are no
+        more."""
+        while record is not None:
+            position = self.view.position(record)
+            if position >= 0:
+                self.goto_image(position)
+                return
+            record = step(record)
+
+    def current_record(self):
+        """The image number of the current image, or None if there is none."""
+        return self.view.record(self.jpgidx) if len(self.view) else None
+
+    def find_bursts_cmd(self):
+        """Group the images into bursts in the background."""
+        from ImageCull import FindBursts
+        images = self.catalog.paths()
+        if not images:
+            return
+        self.burst_str.set("Finding...")
+        self.analysis.submit(
+                'bursts', FindBursts, (images, self.metadata),
+                partial(self.bursts_found, self.catalog, len(images)),
+                self.bursts_failed)
+
+    def bursts_found(self, catalog, count, bursts):
+        if catalog is not self.catalog:
+            return      # The source has been scanned again since.
+        self.bursts = bursts
+        self.bursts_len = count
+        self.update_burst()
+
+    def bursts_failed(self, error):
+        self.burst_str.set('')
+        if isinstance(error, ImportError):
+            error = "Finding bursts needs NumPy: {}".format(error)
+        messagebox.showerror("Find Bursts", str(error))
+
+    def update_burst(self):
+        """Show which burst the current image is in, and where in it."""
+        record = self.current_record()
+        if self.bursts is None or record is None or record >= self.bursts_len:
+            self.burst_str.set('')
+            return
+        number, frame = self.bursts.position(record)
+        self.burst_str.set("{} of {} ({}/{})".format(
+            number + 1, len(self.bursts.groups), frame + 1,
+            len(self.bursts.groups[number])))
+
+    def next_burst_cmd(self, event=None):
+        """Go to the first image of the next burst."""
+        if not WindowKey(event):
+            return
+        record = self.current_record()
+        if self.bursts is not None and record is not None and \
+                record < self.bursts_len:
+            self.goto_record(
+                    self.bursts.next_group(record), self.bursts.next_group)
+
+    def prev_burst_cmd(self, event=None):
+        """Go to the first image of this burst, or of the previous one."""
+        if not WindowKey(event):
+            return
+        record = self.current_record()
+        if self.bursts is not None and record is not None and \
+                record < self.bursts_len:
+            self.goto_record(
+                    self.bursts.prev_group(record), self.bursts.prev_group)
+
+    def select_sharpest_cmd(self):
+        """Select the sharpest image of each burst."""
+        if self.bursts is None:
+            messagebox.showinfo(
+                    "Select Sharpest", "Use View > Find Bursts first.")
+            return
+        self.analysis.submit(
+                'sharpest', self.bursts.sharpest, (self.catalog.paths(),),
+                partial(self.sharpest_found, self.bursts),
+                self.bursts_failed)
+
+    def sharpest_found(self, bursts, indexes):
+        if bursts is self.bursts:
+            self.catalog.select(indexes)
+            self.update_selection()
+
+    def score_images_cmd(self, then=None):
+        """Measure the focus and exposure of the images in the background,
+        then call 'then', if given, once they are known."""
+        from ImageQuality import QualityIndex, ScoreImages
+        images = self.catalog.paths()
+        if not images:
+            return
+        if self.quality is None:
+            self.quality = QualityIndex(GetDataFilename('quality.db'))
+        self.quality_str.set("Scoring...")
+        self.analysis.submit(
+                'quality', ScoreImages, (images, self.quality),
+                partial(self.scores_found, self.catalog, then),
+                self.scores_failed)
+
+    def scores_found(self, catalog, then, scores):
+        if catalog is not self.catalog:
+            return      # The source has been scanned again since.
+        self.scores = scores
+        self.update_quality()
+        if then:
+            then()
+
+    def scores_failed(self, error):
+        self.quality_str.set('')
+        if isinstance(error, ImportError):
+            error = "Scoring images needs NumPy: {}".format(error)
+        messagebox.showerror("Score Images", str(error))
+
+    def update_quality(self):
+        """Show the verdict on the current image, if it has been scored."""
+        record = self.current_record()
+        if self.scores is None or record is None or record >= len(self.scores):
+            self.quality_str.set('')
+        elif self.scores[record] is None:
+            self.quality_str.set("unreadable")
+        else:
+            self.quality_str.set(str(self.scores[record]))
+
+    def select_good_cmd(self):
+        """Select every image judged good, scoring them first if need be."""
+        if self.scores is None:
+            self.score_images_cmd(self.select_good_cmd)
+            return
+        from ImageQuality import GOOD
+        self.catalog.select(
+                record for record, quality in enumerate(self.scores)
+                if quality is not None and quality.assess()[0] == GOOD)
+        self.update_selection()
+
+    def next_borderline_cmd(self, event=None):
+        """Go to the next image neither clearly good nor clearly bad, which
+        are the ones left to look at after Select Good Images."""
+        if event is not None and isinstance(event.widget, Entry):
+            return
+        if self.scores is None:
+            return
+        from ImageQuality import BORDERLINE
+        for position in range(self.jpgidx + 1, len(self.view)):
+            record = self.view.record(position)
+            quality = self.scores[record] if record < len(self.scores) else None
+            if quality is not None and quality.assess()[0] == BORDERLINE:
+                self.goto_image(position)
+                return
+
+    def contact_sheet_cmd(self):
+        self.grid = ThumbnailGrid(
+                self.root, self.view, self.thumbs, self.goto_image,
+                self.view.selected, self.update_selection)
+
+    def update_selection(self):
+        """Show the selection after it has changed."""
+        self.sel_str.set("{} of {}".format(
+            len(self.view.selected), len(self.view)))
+        if len(self.view):
+            self.cb_selected.set(self.jpgidx in self.view.selected)
+        if self.grid:
+            self.grid.draw_selection()
+
+    def select_cmd(self):
+        """Action on the Selected check box."""
+        if not len(self.view):
+            return
+        if self.cb_selected.get():
+            self.view.selected.add(self.jpgidx)
+        else:
+            self.view.selected.discard(self.jpgidx)
+        self.sel_mark = self.jpgidx
+        self.update_selection()
+
+    def toggle_select_cmd(self, event=None):
+        """Select or deselect the current image. The space key is left to
+        the widget with the focus if it uses it, see WindowKey."""
+        if not WindowKey(event):
+            return
+        if not len(self.view):
+            return
+        self.view.selected.symmetric_difference_update([self.jpgidx])
+        self.sel_mark = self.jpgidx
+        self.update_selection()
+
+    def select_range_cmd(self, event=None):
+        """Select every image from the last one selected to the current one."""
+        if not WindowKey(event):
+            return
+        if not len(self.view):
+            return
+        low, high = sorted((self.sel_mark, self.jpgidx))
+        self.view.selected.update(range(low, high + 1))
+        self.update_selection()
+
+    def select_all_cmd(self):
+        self.view.selected.update(range(len(self.view)))
+        self.update_selection()
+
+    def clear_selection_cmd(self):
+        self.view.selected.clear()
+        self.update_selection()
+
     def next_cmd(self):
-        if self.jpgfiles:
-            if self.jpgidx < self.jpglen-1:
+        if len(self.view):
+            if self.jpgidx < len(self.view)-1:
                 self.jpgidx += 1
                 self.update_image_source()
 
     def prev_cmd(self):
-        if self.jpgfiles:
+        if len(self.view):
             if self.jpgidx > 0:
                 self.jpgidx -= 1
                 self.update_image_source()
@@ -224,19 +899,231 @@ class ImageCopyController(object):
 
     def SetSourceDir(self):
         self.SetConfigDir('Source')
-        self.jpgfiles = ListJpgFiles( self.config['DEFAULT']['source'] )
-        self.jpgidx = 0
-        self.jpglen = len(self.jpgfiles)
-
-        if not self.jpgfiles:
-            messagebox.showwarning(
-                    "No JPG files found!",
-                    '\n'.join([
-                        "No JPG files found In directory:",
-                        self.config['DEFAULT']['source']
-                        ])
-                    )
+        self.start_scan()
+
+    def restore_scan(self):
+        """Show the images found by the last scan of the source, at the image
+        last looked at, then list the source again in the background."""
+        with Timer('restore scan'):
+            restored = LoadCatalog(
+                    GetDataFilename('scan.json'),
+                    self.config['DEFAULT']['source'])
+        if restored is None:
+            self.start_scan(warn=False)
+            return
+        catalog, current = restored
+        self.set_catalog(catalog, current or 0)
+        self.start_scan(warn=False, refresh=True)
+
+    def set_catalog(self, catalog, position=0):
+        """Show the images of another catalog, from 'position' in its view."""
+        self.catalog = catalog
+        self.view = self.catalog.view
+        self.jpgidx = position
+        self.sel_mark = position
+        if self.grid is not None and self.grid.open:
+            self.grid.show(self.view, self.view.selected)
+        self.cdt = None
+        self.bursts = None
+        self.burst_str.set('')
+        self.scores = None
+        self.quality_str.set('')
+        if len(self.view):
+            self.update_image_source()
+        self.update_selection()
+
+    def start_scan(self, warn=True, refresh=False):
+        """List the JPG files in the source directory a folder at a time,
+        showing the first image as soon as its folder has been listed. To
+        'refresh' the catalog shown, which was restored from the last scan,
+        the images are listed into a new one which replaces it only once
+        complete, and only if different."""
+        if refresh:
+            self.scan_catalog = Catalog()
         else:
+            self.set_catalog(Catalog())
+            self.scan_catalog = self.catalog
+        self.scan = ScanJpgFolders(self.config['DEFAULT']['source'])
+        self.scan_warn = warn
+        self.scan_step()
+
+    def scan_step(self):
+        """List the next folder of the source on a worker thread."""
+        self.tasks.submit(
+                'scan', self.list_folder, (self.scan,),
+                partial(self.scan_done, self.scan))
+
+    def list_folder(self, scan):
+        """Return the entries of the next folder of the source with JPG files
+        and whether the journal has each as copied, or None when there are no
+        more. Runs on a worker thread."""
+        result = next(scan, None)
+        if result is None:
+            return None
+        folder, entries = result
+        return entries, [
+                self.journal.is_done(SourceKey(entry.path, entry.stat()))
+                for entry in entries]
+
+    def scan_done(self, scan, result):
+        """Add a folder of JPG files to the catalog."""
+        if scan is not self.scan:
+            return
+        if result is None:
+            self.scan = None
+            if self.scan_catalog is not self.catalog:
+                self.refreshed(self.scan_catalog)
+            self.read_catalog()
+            if not len(self.catalog) and self.scan_warn:
+                messagebox.showwarning(
+                        "No JPG files found!",
+                        '\n'.join([
+                            "No JPG files found In directory:",
+                            self.config['DEFAULT']['source']
+                            ])
+                        )
+            return
+
+        entries, copied = result
+        catalog = self.scan_catalog
+        start = len(catalog)
+        catalog.add_entries(entries)
+        for record, done in enumerate(copied, start):
+            if done:
+                catalog.set_flag(record, COPIED)
+        if catalog is self.catalog:     # Not refreshing the images shown.
+            if start == 0 and len(self.view):
+                self.update_image_source()
+            elif len(self.view):
+                self.update_file_number()
+            self.update_selection()
+        self.scan_step()
+
+    def refreshed(self, catalog):
+        """Replace the catalog restored from the last scan by the one just
+        listed, staying on the same image if it is still there. If the same
+        images were found only whether each has been copied is updated.
+
+        Otherwise what was done while the source was listed is carried over
+        by path: the images selected and copied, and the bursts and scores
+        found if no images have been added since."""
+        if catalog.paths() == self.catalog.paths():
+            for record in range(len(catalog)):
+                self.catalog.set_flag(
+                        record, COPIED, catalog.has_flag(record, COPIED))
+            if len(self.view):
+                self.update_file_number()
+            return
+
+        records = dict(
+                (path, record) for record, path in enumerate(catalog.paths()))
+        moved = [records.get(path) for path in self.catalog.paths()]
+        for old, new in enumerate(moved):
+            if new is None:
+                continue
+            for flag in (SELECTED, COPIED):
+                if self.catalog.has_flag(old, flag):
+                    catalog.set_flag(new, flag)
+        added = len(catalog) - (len(moved) - moved.count(None))
+        bursts, bursts_len, scores = self.bursts, self.bursts_len, self.scores
+
+        image = self.view[self.jpgidx] if len(self.view) else None
+        images = list(catalog.view)
+        self.set_catalog(
+                catalog, images.index(image) if image in images else 0)
+
+        if added:
+            return      # The new images have no bursts or scores yet.
+        if bursts is not None and bursts_len == len(moved):
+            from ImageCull import Bursts
+            groups = [[moved[old] for old in group if moved[old] is not None]
+                    for group in bursts.groups]
+            self.bursts = Bursts(
+                    [group for group in groups if group], len(catalog))
+            self.bursts_len = len(catalog)
+        if scores is not None and len(scores) == len(moved):
+            self.scores = [None] * len(catalog)
+            for old, new in enumerate(moved):
+                if new is not None:
+                    self.scores[new] = scores[old]
+        if len(self.view):
+            self.update_burst()
+            self.update_quality()
+
+    def read_catalog(self):
+        """Fill in the capture time, camera and orientation of every image
+        in the background, so they can be sorted and filtered by them."""
+        self.tasks.submit(
+                'catalog', self.read_exif, (self.catalog.paths(),),
+                partial(self.catalog_read, self.catalog))
+
+    def read_exif(self, images):
+        """The ExifInfo of each image, None for those gone. Runs on a worker
+        thread."""
+        infos = []
+        for image in images:
+            try:
+                infos.append(self.metadata.get(image))
+            except OSError:
+                infos.append(None)
+        self.metadata.flush()
+        return infos
+
+    def catalog_read(self, catalog, infos):
+        if catalog is not self.catalog:
+            return      # The source has been scanned again since.
+        for record, info in enumerate(infos):
+            if info is not None:
+                catalog.set_exif(record, info)
+        if self.sort_by.get() != SORT_NAME or self.show_only.get() != 'all':
+            self.show_cmd()
+
+    def sort_key(self):
+        """The sort key chosen in the View menu, as for Catalog.show."""
+        sort_by = self.sort_by.get()
+        if sort_by != 'quality':
+            return self.catalog.sort_key(sort_by)
+        scores = self.scores
+        if scores is None:
+            return None
+
+        def best_first(record):
+            quality = scores[record] if record < len(scores) else None
+            return -quality.score() if quality is not None else 0.0
+        return best_first
+
+    def show_filter(self, record):
+        """The filter chosen in the View menu, relative to image number
+        'record', as for Catalog.show."""
+        show_only = self.show_only.get()
+        if show_only == 'uncopied':
+            return self.catalog.not_copied()
+        if record is None or show_only == 'all':
+            return None
+        if show_only == 'camera':
+            return self.catalog.same_camera(record)
+        return self.catalog.same_day(record)
+
+    def show_cmd(self):
+        """Sort and filter the images as chosen in the View menu, staying on
+        the current image if it is still shown."""
+        if self.sort_by.get() == 'quality' and self.scores is None:
+            self.score_images_cmd(self.show_cmd)
+            return
+        record = self.current_record()
+        view = self.catalog.show(self.sort_key(), self.show_filter(record))
+        if not len(view) and len(self.catalog):
+            messagebox.showinfo("Show", "No images to show, showing all.")
+            self.show_only.set('all')
+            view = self.catalog.show(self.sort_key())
+        self.view = view
+        position = view.position(record) if record is not None else -1
+        self.jpgidx = max(0, position)
+        self.sel_mark = self.jpgidx
+        if self.grid is not None and self.grid.open:
+            self.grid.show(self.view, self.view.selected)
+        self.update_selection()
+        if len(self.view):
             self.update_image_source()
 
     def AboutImageCopy(self):
@@ -258,9 +1145,81 @@ class ImageCopyController(object):
         filemenu.add_command(
                 label="Set Destination Dir", command=self.SetDestinationDir)
         filemenu.add_separator()
+        filemenu.add_command(label="Copy All Images", command=self.copy_all_cmd)
+        filemenu.add_command(
+                label="Copy Selected Images", command=self.copy_selected_cmd)
+        filemenu.add_command(
+                label="Ingest All Cards", command=self.ingest_all_cmd)
+        filemenu.add_checkbutton(
+                label="Watch For Cards", variable=self.cb_watch,
+                command=self.watch_cmd)
+        filemenu.add_checkbutton(
+                label="Turn Copies Upright", variable=self.cb_rotate,
+                command=self.rotate_cmd)
+        filemenu.add_separator()
         filemenu.add_command(label="Exit", command=self.root.quit)
         menubar.add_cascade(label="File", menu=filemenu)
 
+        viewmenu = Menu(menubar, tearoff=0)
+        viewmenu.add_command(
+                label="Contact Sheet", command=self.contact_sheet_cmd)
+        viewmenu.add_separator()
+        sortmenu = Menu(viewmenu, tearoff=0)
+        for label, value in (
+                ("File Name", SORT_NAME), ("Capture Time", SORT_TIME),
+                ("Camera", SORT_CAMERA), ("Quality", 'quality')):
+            sortmenu.add_radiobutton(
+                    label=label, value=value, variable=self.sort_by,
+                    command=self.show_cmd)
+        viewmenu.add_cascade(label="Sort By", menu=sortmenu)
+        showmenu = Menu(viewmenu, tearoff=0)
+        for label, value in (
+                ("All Images", 'all'), ("This Camera Only", 'camera'),
+                ("This Day Only", 'day'), ("Not Yet Copied", 'uncopied')):
+            showmenu.add_radiobutton(
+                    label=label, value=value, variable=self.show_only,
+                    command=self.show_cmd)
+        viewmenu.add_cascade(label="Show", menu=showmenu)
+        viewmenu.add_separator()
+        viewmenu.add_command(
+                label="Find Bursts", command=self.find_bursts_cmd)
+        viewmenu.add_command(
+                label="Next Burst", accelerator="PgDn",
+                command=self.next_burst_cmd)
+        viewmenu.add_command(
+                label="Previous Burst", accelerator="PgUp",
+                command=self.prev_burst_cmd)
+        viewmenu.add_separator()
+        viewmenu.add_command(
+                label="Score Images", command=self.score_images_cmd)
+        viewmenu.add_command(
+                label="Next Borderline", accelerator="B",
+                command=self.next_borderline_cmd)
+        viewmenu.add_separator()
+        viewmenu.add_checkbutton(
+                label="Performance Panel", variable=self.cb_perf,
+                command=self.perf_panel_cmd)
+        viewmenu.add_command(
+                label="Save Timing Trace...", command=self.save_trace_cmd)
+        menubar.add_cascade(label="View", menu=viewmenu)
+
+        selmenu = Menu(menubar, tearoff=0)
+        selmenu.add_command(
+                label="Toggle Current", accelerator="Space",
+                command=self.toggle_select_cmd)
+        selmenu.add_command(
+                label="Select Range To Current", accelerator="Shift+Space",
+                command=self.select_range_cmd)
+        selmenu.add_command(label="Select All", command=self.select_all_cmd)
+        selmenu.add_command(
+                label="Select Sharpest Of Each Burst",
+                command=self.select_sharpest_cmd)
+        selmenu.add_command(
+                label="Select Good Images", command=self.select_good_cmd)
+        selmenu.add_command(
+                label="Clear Selection", command=self.clear_selection_cmd)
+        menubar.add_cascade(label="Select", menu=selmenu)
+
         helpmenu = Menu(menubar, tearoff=0)
         helpmenu.add_command(label="About", command=self.AboutImageCopy)
         menubar.add_cascade(label="Help", menu=helpmenu)
@@ -323,6 +1282,56 @@ class ImageCopyController(object):
                 textvariable=self.dst_str, width=85, padx=5) 
         info.pack(side=LEFT, fill=X, expand=YES)
 
+    def perf_panel_cmd(self):
+        """Show or hide the performance panel."""
+        if self.cb_perf.get():
+            self.perf_frm.pack(
+                    side=TOP, fill=X, expand=NO, after=self.perf_after)
+            self.update_perf()
+        else:
+            self.perf_frm.pack_forget()
+
+    def update_perf(self):
+        """Refresh the performance panel every second while it is shown."""
+        if not self.cb_perf.get():
+            return
+        summary = STATS.summary()
+        lines = ["{:<16}{:>6}{:>8}{:>8}{:>8}".format(
+            "Stage", "n", "mean", "p90", "max")]
+        for name, stage in sorted(summary['stages'].items()):
+            lines.append("{:<16}{:>6}{:>8.1f}{:>8.1f}{:>8.1f}".format(
+                name[:15], stage['count'], stage['mean_ms'],
+                stage['p90_ms'], stage['max_ms']))
+        for name, count in sorted(summary['counters'].items()):
+            lines.append("{:<16}{:>6}".format(name[:15], count))
+        lines.append("Cache: {} images, {:.0f} MB".format(
+            len(self.cache), self.cache.bytes / (1024.0 * 1024.0)))
+        self.perf_str.set('\n'.join(lines))
+        self.root.after(1000, self.update_perf)
+
+    def save_trace_cmd(self):
+        filename = filedialog.asksaveasfilename(
+                title="Save timing trace", defaultextension='.json',
+                filetypes=[("JSON trace", '*.json')])
+        if filename:
+            STATS.dump(filename)
+
+    def performance_frame(self, parent, after):
+        """Frame showing timings of each stage in milliseconds, packed after
+        the frame 'after' when View > Performance Panel is ticked."""
+        self.perf_frm = Frame(parent, relief=RIDGE, bd=5)
+        self.perf_after = after
+
+        title = Label(
+                self.perf_frm, text="Performance (ms)", width=30,
+                justify=CENTER, pady=5, padx=5)
+        title.pack(side=TOP, fill=X, expand=NO)
+
+        info = Label(
+                self.perf_frm, textvariable=self.perf_str, bg='black',
+                fg='white', anchor=W, justify=LEFT, font=('Courier', 8))
+        info.pack(side=TOP, fill=X, expand=NO)
+
     def file_info_frame(self, parent):
         """Frame to display the image information."""
         frm = Frame(parent, relief=RIDGE, bd=5)
@@ -344,6 +1353,39 @@ class ImageCopyController(object):
                 anchor=W, width=20)
         filenum.pack(side=LEFT, fill=X, expand=NO)
 
+        sel_frame = Frame(frm)
+        sel_frame.pack(side=TOP, fill=X, expand=NO)
+        sel_check = Checkbutton(
+                sel_frame, text="Selected:", width=10, anchor=W,
+                variable=self.cb_selected, command=self.select_cmd)
+        sel_check.pack(side=LEFT, fill=X, expand=NO)
+        selnum = Label(
+                sel_frame, textvariable=self.sel_str, bg='black', fg='white',
+                anchor=W, width=20)
+        selnum.pack(side=LEFT, fill=X, expand=NO)
+
+        burst_frame = Frame(frm)
+        burst_frame.pack(side=TOP, fill=X, expand=NO)
+        burst_legend = Label(
+                burst_frame, text="Burst:", width=10,
+                anchor=W, padx=5, pady=5)
+        burst_legend.pack(side=LEFT, fill=X, expand=NO)
+        burst = Label(
+                burst_frame, textvariable=self.burst_str, bg='black',
+                fg='white', anchor=W, width=20)
+        burst.pack(side=LEFT, fill=X, expand=NO)
+
+        quality_frame = Frame(frm)
+        quality_frame.pack(side=TOP, fill=X, expand=NO)
+        quality_legend = Label(
+                quality_frame, text="Quality:", width=10,
+                anchor=W, padx=5, pady=5)
+        quality_legend.pack(side=LEFT, fill=X, expand=NO)
+        quality = Label(
+                quality_frame, textvariable=self.quality_str, bg='black',
+                fg='white', anchor=W, width=20)
+        quality.pack(side=LEFT, fill=X, expand=NO)
+
         fn_frame = Frame(frm)
         fn_frame.pack(side=TOP, fill=X, expand=NO)
         fn_legend = Label(
@@ -387,6 +1429,7 @@ class ImageCopyController(object):
                 zm_frame, textvariable=self.zoom_str, bg='black', fg='white',
                 anchor=W, width=20)
         date.pack(side=LEFT, fill=X, expand=NO)
+        return frm
 
     def user_input_frame(self, parent):
         """Frame for user to input a part of the filename when copied.
@@ -422,6 +1465,7 @@ class ImageCopyController(object):
 
         for choice in self.config['DEFAULT']['descr'].split(','):
             self.listbox.insert(END, choice)
+        self.usr_descr = self.listbox.get(0, END)
 
     def update_select(self, event=None):
         if not len(self.user_str.get()):
@@ -481,6 +1525,184 @@ def main():
     root.title("ImageCopy")
     control = ImageCopyController(root)
     root.mainloop()
-    
+
+def batch_main(argv=None):
+    """Command line batch copy, without the GUI. Defaults for the source,
+    destination and name options are taken from the config file."""
+    import argparse
+    from ImageDerive import DerivativePool, ParseSize
+    config = LoadConfigFile()
+    defaults = config['DEFAULT']
+
+    parser = argparse.ArgumentParser(
+            description="Copy all JPG images from source to destination.")
+    parser.add_argument('--batch', action='store_true',
+            help="copy without starting the GUI")
+    parser.add_argument('--source', nargs='+', default=[defaults['source']],
+            help="source folders; several are copied in parallel, one "
+            "reader per device")
+    parser.add_argument('--destination', default=defaults['destination'])
+    parser.add_argument('--workers', type=int,
+            default=config.getint('DEFAULT', 'workers', fallback=4),
+            help="number of copies in flight at once")
+    parser.add_argument('--date', action='store_true',
+            default=config.getboolean('DEFAULT', 'use_date'))
+    parser.add_argument('--no-date', dest='date', action='store_false')
+    parser.add_argument('--time', action='store_true',
+            default=config.getboolean('DEFAULT', 'use_time'))
+    parser.add_argument('--no-time', dest='time', action='store_false')
+    parser.add_argument('--user', default='',
+            help="user description to add to each name")
+    parser.add_argument('--no-name', dest='name', action='store_false',
+            default=config.getboolean('DEFAULT', 'use_name'))
+    parser.add_argument('--no-journal', dest='journal', action='store_false',
+            help="copy again images the journal records as already copied")
+    parser.add_argument('--no-dedup', dest='dedup', action='store_false',
+            default=config.getboolean('DEFAULT', 'skip_duplicates', fallback=True),
+            help="copy images already in the destination under another name")
+    parser.add_argument('--no-verify', dest='verify', action='store_false',
+            default=config.getboolean('DEFAULT', 'verify', fallback=True),
+            help="let the kernel copy files without hashing and reading back")
+    parser.add_argument('--buffer-kb', type=int,
+            default=config.getint('DEFAULT', 'buffer_kb', fallback=4096),
+            help="size of the copy buffer in KB")
+    parser.add_argument('--previews', action='store_true',
+            default=config.getboolean('DEFAULT', 'previews', fallback=False),
+            help="also make a screen sized preview of each image copied, "
+            "in a previews folder in the destination")
+    parser.add_argument('--no-previews', dest='previews', action='store_false')
+    parser.add_argument('--preview-size', type=ParseSize,
+            default=config.get('DEFAULT', 'preview_size', fallback='1600x1200'),
+            help="largest preview, as WIDTHxHEIGHT")
+    parser.add_argument('--preview-workers', type=int,
+            help="processes making previews, default one per core")
+    parser.add_argument('--rotate', action='store_true',
+            default=config.getboolean('DEFAULT', 'rotate_copies', fallback=False),
+            help="turn copies upright as their EXIF orientation says, "
+            "losslessly with jpegtran")
+    parser.add_argument('--no-rotate', dest='rotate', action='store_false')
+    parser.add_argument('--watch', action='store_true',
+            help="wait for cards to be inserted and copy their new images, "
+            "instead of copying the source")
+    parser.add_argument('--watch-root', action='append',
+            help="folder to look for cards in, may be repeated")
+    parser.add_argument('--watch-interval', type=float,
+            default=config.getfloat('DEFAULT', 'watch_interval', fallback=2))
+    args = parser.parse_args(argv)
+    args.watch_root = args.watch_root or WatchRoots(config)
+    if args.watch and not args.journal:
+        parser.error("--watch needs the journal to tell which images are new")
+
+    metadata = MetadataIndex(GetDataFilename('meta.db'))
+    journal = CopyJournal(GetDataFilename('journal.db')) if args.journal else None
+    dupes = None
+    if args.dedup:
+        dupes = DuplicateIndex(GetDataFilename('library.db'))
+        dupes.refresh(args.destination)
+
+    previews = None
+    if args.previews:
+        previews = DerivativePool(args.preview_workers, args.preview_size)
+
+    if args.watch:
+        status = WatchCopy(args, metadata, journal, dupes, previews)
+    elif len(args.source) > 1:
+        status = IngestCopy(
+                args, [(source, ListJpgFiles(source)) for source in args.source],
+                metadata, journal, dupes, previews)
+    else:
+        status = BatchCopy(
+                args, ListJpgFiles(args.source[0]), metadata, journal, dupes,
+                previews)
+
+    if previews is not None:
+        previews.close()
+        for image, err in previews.errors:
+            print("FAILED preview of {}: {}".format(image, err), file=sys.stderr)
+        print(previews)
+
+    metadata.close()
+    if journal is not None:
+        journal.close()
+    if dupes is not None:
+        dupes.close()
+    return status
+
+def BatchCopy(args, images, metadata, journal, dupes, previews=None):
+    """Copy 'images' as the command line 'args' say, printing the progress
+    and result. Returns the exit status."""
+    jobs = BuildCopyJobs(
+            images, args.destination,
+            NameOptions(args.date, args.time, args.user, args.name),
+            metadata, journal)
+
+    def progress(job, stats):
+        print("{} -> {}".format(job.source, job.destination))
+
+    stats = BatchCopier(
+            args.workers, progress, journal, dupes,
+            args.verify, args.buffer_kb * 1024,
+            previews.copied if previews else None,
+            RotateCopied if args.rotate else None).copy(jobs)
+    for job, duplicate in stats.duplicates:
+        print("{} already copied as {}".format(job.source, duplicate))
+    for job, err in stats.errors:
+        print("FAILED {}: {}".format(job.source, err), file=sys.stderr)
+    print(stats)
+    return 1 if stats.errors else 0
+
+def IngestCopy(args, sources, metadata, journal, dupes, previews=None):
+    """Copy a list of (source, images) as the command line 'args' say, with
+    one reader per device. Returns the exit status."""
+    jobs = BuildIngestJobs(
+            sources, args.destination,
+            NameOptions(args.date, args.time, args.user, args.name),
+            metadata, journal)
+
+    def progress(source, job, stats, total):
+        print("{} -> {} [{}/{} {}/{}]".format(
+            job.source, job.destination, stats.files, stats.total_files,
+            total.files, total.total_files))
+
+    scheduler = IngestScheduler(
+            args.workers, progress, journal, dupes,
+            args.verify, args.buffer_kb * 1024,
+            derive=previews.copied if previews else None,
+            rewrite=RotateCopied if args.rotate else None)
+    total = scheduler.copy(jobs)
+    for job, duplicate in total.duplicates:
+        print("{} already copied as {}".format(job.source, duplicate))
+    for job, err in total.errors:
+        print("FAILED {}: {}".format(job.source, err), file=sys.stderr)
+    print('\n'.join(scheduler.summary()))
+    return 1 if total.errors else 0
+
+def WatchCopy(args, metadata, journal, dupes, previews=None):
+    """Copy the new images on each card inserted until interrupted."""
+    from ImageWatch import CardWatcher, NewImages
+    watcher = CardWatcher(args.watch_root, args.watch_interval)
+    print("Watching {} for cards, Ctrl+C to stop".format(
+        ', '.join(watcher.roots)))
+    status = 0
+    try:
+        while True:
+            sources = []
+            for card in watcher.wait():
+                images = NewImages(card, journal)
+                if images:
+                    print("{}: {} new images".format(card, len(images)))
+                    sources.append((card, images))
+            if sources:
+                status |= IngestCopy(
+                        args, sources, metadata, journal, dupes, previews)
+                metadata.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    return status
+
 if __name__ == "__main__":
+    if '--batch' in sys.argv[1:]:
+        sys.exit(batch_main())
     main()
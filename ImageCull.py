@@ -0,0 +1,130 @@
+"""Group near identical images, e.g. the frames of a 10 fps burst, so they
+can be culled a group at a time instead of one full decode at a time.
+
+Each image is reduced to a 64 bit difference hash (dHash) of its EXIF
+thumbnail, or of a draft decode if it has none. Images taken in sequence
+fall in the same burst while they are less than BURST_GAP seconds apart and
+their hashes differ in at most BURST_DISTANCE bits. The hash comparisons and
+the sharpness measure use NumPy, which is imported when first needed so
+that the rest of ImageCopy runs without it."""
+
+import io
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from ImageCache import DecodeImage
+from ImageExif import CaptureTime, ReadExifThumbnail
+from ImageQuality import Focus, GreyArray, QUALITY_SIZE
+
+HASH_SIZE = 8           # dHash of 8x8 bits.
+BURST_GAP = 1.0         # Most seconds between frames of a burst.
+BURST_DISTANCE = 12     # Most bits of 64 by which frames of a burst differ.
+
+def SmallImage(image_path, size=(160, 120)):
+    """A grey scale image at least 'size', from the EXIF thumbnail if there
+    is one, else from a draft decode."""
+    data = ReadExifThumbnail(image_path)
+    if data:
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+            return image.convert('L')
+        except (IOError, OSError, SyntaxError):
+            pass
+    return DecodeImage(image_path, fit=size).convert('L')
+
+def DHash(image):
+    """The 64 bit difference hash of an image: whether each pixel of a 9x8
+    reduction is brighter than its right hand neighbour."""
+    import numpy as np
+    small = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+def HashImages(images, workers=4):
+    """dHashes of the images as a NumPy uint64 array. Thumbnails are read
+    and decoded by a few threads, as PIL releases the GIL while decoding."""
+    import numpy as np
+    with ThreadPoolExecutor(workers) as pool:
+        hashes = list(pool.map(
+            lambda image_path: DHash(SmallImage(image_path)), images))
+    return np.array(hashes, dtype=np.uint64)
+
+def HashDistances(a, b):
+    """Number of bits which differ between two arrays of 64 bit hashes."""
+    import numpy as np
+    diff = np.bitwise_xor(a, b).astype('>u8')
+    return np.unpackbits(diff.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+def BurstIds(times, hashes, gap=BURST_GAP, distance=BURST_DISTANCE):
+    """Burst number of each image, from arrays of capture times in seconds
+    and hashes, both in capture time order."""
+    import numpy as np
+    if len(times) == 0:
+        return np.zeros(0, dtype=np.int64)
+    breaks = (np.diff(times) > gap) | \
+            (HashDistances(hashes[1:], hashes[:-1]) > distance)
+    return np.concatenate(([0], np.cumsum(breaks)))
+
+def Sharpness(image_path):
+    """Variance of the Laplacian of a reduced decode. Higher is sharper."""
+    return Focus(GreyArray(image_path, QUALITY_SIZE))
+
+class Bursts(object):
+    """The images of a card grouped into bursts.
+
+    'groups' is a list of lists of image indexes, in capture time order, and
+    'group_of' the group number of each image index."""
+
+    def __init__(self, groups, count):
+        self.groups = groups
+        self.group_of = [0] * count
+        for number, group in enumerate(groups):
+            for index in group:
+                self.group_of[index] = number
+
+    def position(self, index):
+        """(group number, frame number in the group) of an image index."""
+        number = self.group_of[index]
+        return number, self.groups[number].index(index)
+
+    def next_group(self, index):
+        """First image of the group after the one holding 'index', or None."""
+        number = self.group_of[index] + 1
+        return self.groups[number][0] if number < len(self.groups) else None
+
+    def prev_group(self, index):
+        """First image of the group holding 'index', or of the one before if
+        'index' is already the first. None if there is none."""
+        number = self.group_of[index]
+        if self.groups[number][0] == index:
+            number -= 1
+        return self.groups[number][0] if number >= 0 else None
+
+    def sharpest(self, images, workers=4):
+        """The sharpest image index of each group, single images included.
+        Only the images in groups of more than one are decoded."""
+        scored = [index for group in self.groups if len(group) > 1
+                for index in group]
+        with ThreadPoolExecutor(workers) as pool:
+            scores = dict(zip(
+                scored, pool.map(Sharpness, [images[i] for i in scored])))
+        return [max(group, key=lambda index: scores.get(index, 0))
+                for group in self.groups]
+
+def FindBursts(images, metadata=None, gap=BURST_GAP, distance=BURST_DISTANCE):
+    """Group a list of image paths into Bursts. 'metadata' is an optional
+    MetadataIndex for the capture times."""
+    import numpy as np
+    times = np.array([
+        CaptureTime(image, metadata).timestamp() for image in images])
+    order = np.lexsort((np.arange(len(images)), times))
+    hashes = HashImages([images[i] for i in order])
+    ids = BurstIds(times[order], hashes, gap, distance)
+
+    groups = []
+    for index, number in zip(order.tolist(), ids.tolist()):
+        if number == len(groups):
+            groups.append([])
+        groups[number].append(index)
+    return Bursts(groups, len(images))
@@ -0,0 +1,99 @@
+"""Screen sized previews of the images copied, made alongside the copies.
+
+Decoding, resizing and encoding JPEGs holds the GIL, so previews are made in
+a pool of processes, one per core. Previews are decoded in draft mode from
+the copy just written rather than from the card. At most a few previews per
+process are queued at once, so a batch of any size streams through in
+bounded memory."""
+
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from ImageCache import DecodeImage
+from ImageOrient import OrientedSize, OrientImage, ReadOrientation
+from ImageStats import STATS
+
+PREVIEW_SIZE = (1600, 1200)
+PREVIEW_DIR = 'previews'
+PREVIEW_QUALITY = 85
+QUEUE_PER_WORKER = 2    # Previews queued for each process.
+
+def ParseSize(text):
+    """(width, height) from a size like '1600x1200'."""
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+def PreviewName(image, directory=PREVIEW_DIR):
+    """The preview of a copied image, in 'directory' beside it."""
+    folder, name = os.path.split(image)
+    return os.path.join(folder, directory, name)
+
+def MakePreview(image, preview, size=PREVIEW_SIZE, quality=PREVIEW_QUALITY):
+    """Write a preview of 'image' fitting 'size', turned upright and
+    resampled as ImageCanvas does to fit the canvas. Runs in a worker
+    process; returns the seconds taken."""
+    start = time.perf_counter()
+    orientation = ReadOrientation(image)
+    decoded = OrientImage(
+            DecodeImage(image, fit=OrientedSize(size, orientation)),
+            orientation)
+    width, height = decoded.size
+    scale = min(float(size[0]) / width, float(size[1]) / height, 1.0)
+    fit = (max(1, int(width * scale)), max(1, int(height * scale)))
+    if fit != decoded.size:
+        decoded = decoded.resize(fit, Image.LANCZOS)
+
+    os.makedirs(os.path.dirname(preview), exist_ok=True)
+    temp = '{}.{}.tmp'.format(preview, os.getpid())
+    decoded.save(temp, 'JPEG', quality=quality)
+    os.replace(temp, preview)
+    return time.perf_counter() - start
+
+class DerivativePool(object):
+    """Make previews in a pool of 'workers' processes, by default one per
+    core. 'submit' may be called from any thread and blocks while the queue
+    is full."""
+
+    def __init__(self, workers=None, size=PREVIEW_SIZE, directory=PREVIEW_DIR,
+            quality=PREVIEW_QUALITY):
+        self.workers = max(1, int(workers or os.cpu_count() or 1))
+        self.size = size
+        self.directory = directory
+        self.quality = quality
+        self.executor = ProcessPoolExecutor(self.workers)
+        self.slots = threading.BoundedSemaphore(QUEUE_PER_WORKER * self.workers)
+        self.lock = threading.Lock()
+        self.done = 0
+        self.errors = []    # (image, exception)
+
+    def submit(self, image):
+        """Queue a preview of 'image', which has just been copied."""
+        self.slots.acquire()
+        future = self.executor.submit(
+                MakePreview, image, PreviewName(image, self.directory),
+                self.size, self.quality)
+        future.add_done_callback(
+                lambda future: self._finished(image, future))
+
+    def _finished(self, image, future):
+        self.slots.release()
+        try:
+            STATS.add('preview', future.result())
+            with self.lock:
+                self.done += 1
+        except Exception as err:
+            with self.lock:
+                self.errors.append((image, err))
+
+    def copied(self, job):
+        """Hook for BatchCopier and IngestScheduler: preview each copy."""
+        self.submit(job.destination)
+
+    def close(self):
+        """Wait for the queued previews to be made."""
+        self.executor.shutdown(wait=True)
+
+    def __str__(self):
+        return "{} previews, {} failed".format(self.done, len(self.errors))
@@ -0,0 +1,207 @@
+"""Find images which have already been copied to the destination library,
+whatever name they were given, by comparing their contents.
+
+Candidates are narrowed down by file size, then by a hash of the first and
+last PARTIAL_SIZE bytes, and only then confirmed by a hash of the whole file.
+Hashes of library files are computed when first needed and kept on disk."""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from ImageBatch import HASH_NAME, ReadInto
+from ImageScan import ScanJpgFiles
+
+PARTIAL_SIZE = 64 * 1024
+
+def PartialHash(path, size=None):
+    """Hash of the first and last PARTIAL_SIZE bytes of a file."""
+    if size is None:
+        size = os.path.getsize(path)
+    digest = hashlib.new(HASH_NAME)
+    with open(path, 'rb') as fp:
+        digest.update(fp.read(PARTIAL_SIZE))
+        if size > 2 * PARTIAL_SIZE:
+            fp.seek(-PARTIAL_SIZE, os.SEEK_END)
+            digest.update(fp.read(PARTIAL_SIZE))
+        else:
+            digest.update(fp.read())
+    return digest.hexdigest()
+
+def FullHash(path):
+    """Hash of the whole file, the same as CopyFile computes."""
+    digest = hashlib.new(HASH_NAME)
+    with open(path, 'rb', buffering=0) as fp:
+        ReadInto(fp, digest)
+    return digest.hexdigest()
+
+class DuplicateIndex(object):
+    """Content fingerprints of the images in the destination library.
+
+    Rows are [size, mtime, partial hash, full hash, source size, source
+    hash], hashes being None until needed. The source size and hash are
+    those of the image as copied, for a copy changed since, e.g. turned
+    upright, and None for others, so a changed copy is still found as the
+    copy of its source. The whole index is held in memory, grouped by size
+    and by source size, once it is first used."""
+
+    def __init__(self, filename):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute(
+                'CREATE TABLE IF NOT EXISTS library ('
+                'path TEXT PRIMARY KEY, size INTEGER, mtime REAL, '
+                'partial TEXT, full TEXT, '
+                'source_size INTEGER, source_full TEXT)')
+        columns = [row[1] for row in self.db.execute(
+            'PRAGMA table_info(library)')]
+        if 'source_size' not in columns:
+            self.db.execute('ALTER TABLE library ADD COLUMN source_size INTEGER')
+            self.db.execute('ALTER TABLE library ADD COLUMN source_full TEXT')
+            self.db.commit()
+        self.rows = None
+        self.by_size = None
+        self.by_source = None
+
+    def __len__(self):
+        self._load()
+        return len(self.rows)
+
+    def _load(self):
+        """Read the index into memory the first time it is needed rather
+        than when it is opened, as a large library takes a while to read."""
+        with self.lock:
+            if self.rows is None:
+                self.rows = {}
+                self.by_size = {}
+                self.by_source = {}
+                for row in self.db.execute(
+                        'SELECT path, size, mtime, partial, full, '
+                        'source_size, source_full FROM library'):
+                    self._set(row[0], list(row[1:]))
+
+    def _set(self, path, row):
+        old = self.rows.get(path)
+        if old:
+            self._unindex(path, old)
+        self.rows[path] = row
+        self.by_size.setdefault(row[0], set()).add(path)
+        if row[4] is not None:
+            self.by_source.setdefault(row[4], set()).add(path)
+
+    def _unindex(self, path, row):
+        self.by_size[row[0]].discard(path)
+        if row[4] is not None:
+            self.by_source[row[4]].discard(path)
+
+    def _remove(self, path):
+        self._unindex(path, self.rows.pop(path))
+
+    def _store(self, path):
+        self.db.execute(
+                'INSERT OR REPLACE INTO library (path, size, mtime, partial, '
+                'full, source_size, source_full) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [path] + self.rows[path])
+
+    def refresh(self, destination):
+        """Bring the index up to date with the JPGs under 'destination'.
+        Only files which are new or have changed size or mtime are updated,
+        and their hashes are left until they are needed. Previews made by
+        ImageDerive are not library images, so are left out."""
+        from ImageDerive import PREVIEW_DIR
+        self._load()
+        prefix = os.path.join(os.path.abspath(destination), '')
+        seen = set()
+        with self.lock:
+            for entry in ScanJpgFiles(
+                    destination, recursive=True, skip=(PREVIEW_DIR,)):
+                path = os.path.abspath(entry.path)
+                st = entry.stat()
+                seen.add(path)
+                row = self.rows.get(path)
+                if row and row[0] == st.st_size and row[1] == st.st_mtime:
+                    continue
+                self._set(
+                        path, [st.st_size, st.st_mtime, None, None, None, None])
+                self._store(path)
+
+            for path in [p for p in self.rows if p.startswith(prefix)]:
+                if path not in seen:
+                    self._remove(path)
+                    self.db.execute('DELETE FROM library WHERE path = ?', (path,))
+            self.db.commit()
+
+    def add(self, path, size, digest=None, source=None):
+        """Add a file just copied into the library. 'digest' is its full
+        hash if known, as returned by CopyFile. If the copy was changed after
+        it was made, 'source' is the (size, full hash) it was copied with."""
+        self._load()
+        path = os.path.abspath(path)
+        source_size, source_full = source or (None, None)
+        with self.lock:
+            self._set(path, [
+                size, os.path.getmtime(path), None, digest, source_size,
+                source_full])
+            self._store(path)
+            self.db.commit()
+
+    def _hash(self, path, column, func):
+        """Return a hash column of a library file, computing and storing it
+        if it is not known yet."""
+        with self.lock:
+            row = self.rows.get(path)
+            if row is None:
+                return None
+            value = row[column]
+        if value is None:
+            value = func(path)
+            with self.lock:
+                if path in self.rows:
+                    self.rows[path][column] = value
+                    self._store(path)
+                    self.db.commit()
+        return value
+
+    def find(self, source, size=None):
+        """Return the path of a library file with the same contents as
+        'source', or None if there is none."""
+        self._load()
+        if size is None:
+            size = os.path.getsize(source)
+        with self.lock:
+            candidates = sorted(self.by_size.get(size, ()))
+            changed = sorted(self.by_source.get(size, ()))
+        if not candidates and not changed:
+            return None
+
+        full = None
+        if candidates:
+            partial = PartialHash(source, size)
+        for path in candidates:
+            try:
+                if self._hash(path, 2, PartialHash) != partial:
+                    continue
+                if full is None:
+                    full = FullHash(source)
+                if self._hash(path, 3, FullHash) == full and \
+                        os.path.exists(path):
+                    return path
+            except (IOError, OSError):
+                continue
+
+        for path in changed:
+            try:
+                if full is None:
+                    full = FullHash(source)
+            except (IOError, OSError):
+                return None
+            with self.lock:
+                row = self.rows.get(path)
+            if row is not None and row[5] == full and os.path.exists(path):
+                return path
+        return None
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
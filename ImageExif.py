@@ -0,0 +1,277 @@
+"""Read EXIF metadata from JPEG images without decoding any pixels.
+
+The file is memory mapped and only its marker segments up to the frame
+header (SOF) are walked, so a few KB are read from the card however large
+the image. Results can be kept in a MetadataIndex on disk, so that images
+which have not changed since they were last seen cost a single stat."""
+
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+from datetime import datetime
+
+# TIFF tags used.
+TAG_MODEL = 0x0110
+TAG_ORIENTATION = 0x0112
+TAG_DATETIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_SUBSEC_ORIGINAL = 0x9291
+TAG_THUMBNAIL_OFFSET = 0x0201
+TAG_THUMBNAIL_LENGTH = 0x0202
+
+# Start of frame markers, which hold the image dimensions. C4, C8 and CC are
+# other segments in the same range.
+SOF_MARKERS = frozenset(range(0xc0, 0xd0)) - frozenset((0xc4, 0xc8, 0xcc))
+# Markers with no length or body.
+STANDALONE_MARKERS = frozenset([0x01, 0xd8] + list(range(0xd0, 0xd8)))
+
+class ExifInfo(object):
+    """The EXIF fields ImageCopy uses, None where not present."""
+    __slots__ = ('datetime', 'subsec', 'model', 'orientation')
+
+    def __init__(self, datetime=None, subsec=None, model=None, orientation=None):
+        self.datetime = datetime
+        self.subsec = subsec
+        self.model = model
+        self.orientation = orientation
+
+    def capture_time(self):
+        """Return DateTimeOriginal, with SubSecTimeOriginal as fractions of
+        a second, as a datetime. None if there is no valid date."""
+        try:
+            cdt = datetime.strptime(self.datetime, '%Y:%m:%d %H:%M:%S')
+        except (TypeError, ValueError):
+            return None
+        if self.subsec and self.subsec.isdigit():
+            cdt = cdt.replace(microsecond=int(self.subsec[:6].ljust(6, '0')))
+        return cdt
+
+class JpegHeader(object):
+    """What the marker segments of a JPEG say about it: its (width, height),
+    ExifInfo, the (offset, length) in the file of the EXIF thumbnail and the
+    (offset, byte order) in the file of the Orientation value. Each is None
+    if not found."""
+    __slots__ = ('size', 'exif', 'thumbnail', 'orientation_at')
+
+    def __init__(self):
+        self.size = None
+        self.exif = None
+        self.thumbnail = None
+        self.orientation_at = None
+
+def ReadIfd(tiff, offset, endian):
+    """Return {tag: value} for the ASCII, SHORT and LONG entries of the IFD
+    at 'offset', and the offset of the next IFD."""
+    values = {}
+    count = struct.unpack_from(endian + 'H', tiff, offset)[0]
+    for entry in range(count):
+        pos = offset + 2 + entry * 12
+        tag, typ, num = struct.unpack_from(endian + 'HHI', tiff, pos)
+        if typ == 2:
+            start = pos + 8 if num <= 4 else \
+                    struct.unpack_from(endian + 'I', tiff, pos + 8)[0]
+            text = bytes(tiff[start:start + num]).split(b'\x00', 1)[0]
+            values[tag] = text.decode('ascii', 'replace').strip()
+        elif typ == 3:
+            values[tag] = struct.unpack_from(endian + 'H', tiff, pos + 8)[0]
+        elif typ == 4:
+            values[tag] = struct.unpack_from(endian + 'I', tiff, pos + 8)[0]
+    next_ifd = struct.unpack_from(endian + 'I', tiff, offset + 2 + count * 12)[0]
+    return values, next_ifd
+
+def ParseExif(tiff):
+    """Parse the TIFF structure of an EXIF APP1 segment into an ExifInfo."""
+    endian = {b'II': '<', b'MM': '>'}.get(bytes(tiff[0:2]))
+    if endian is None:
+        return ExifInfo()
+
+    ifd0, _ = ReadIfd(tiff, struct.unpack_from(endian + 'I', tiff, 4)[0], endian)
+    exif = {}
+    if TAG_EXIF_IFD in ifd0:
+        exif, _ = ReadIfd(tiff, ifd0[TAG_EXIF_IFD], endian)
+
+    return ExifInfo(
+            exif.get(TAG_DATETIME_ORIGINAL, ifd0.get(TAG_DATETIME)),
+            exif.get(TAG_SUBSEC_ORIGINAL),
+            ifd0.get(TAG_MODEL),
+            ifd0.get(TAG_ORIENTATION))
+
+def ExifThumbnail(tiff):
+    """Return (offset, length) in the TIFF structure of the JPEG thumbnail
+    in IFD1, typically 160x120, or None if there is not one."""
+    endian = {b'II': '<', b'MM': '>'}.get(bytes(tiff[0:2]))
+    if endian is None:
+        return None
+    _, ifd1 = ReadIfd(tiff, struct.unpack_from(endian + 'I', tiff, 4)[0], endian)
+    if not ifd1:
+        return None
+    thumb, _ = ReadIfd(tiff, ifd1, endian)
+    offset = thumb.get(TAG_THUMBNAIL_OFFSET)
+    length = thumb.get(TAG_THUMBNAIL_LENGTH)
+    if not offset or not length or offset + length > len(tiff):
+        return None
+    return offset, length
+
+def OrientationOffset(tiff):
+    """Return (offset, byte order) in the TIFF structure of the SHORT value
+    of the Orientation tag in IFD0, or None if there is not one."""
+    endian = {b'II': '<', b'MM': '>'}.get(bytes(tiff[0:2]))
+    if endian is None:
+        return None
+    offset = struct.unpack_from(endian + 'I', tiff, 4)[0]
+    count = struct.unpack_from(endian + 'H', tiff, offset)[0]
+    for entry in range(count):
+        pos = offset + 2 + entry * 12
+        tag, typ = struct.unpack_from(endian + 'HH', tiff, pos)
+        if tag == TAG_ORIENTATION and typ == 3:
+            return pos + 8, endian
+    return None
+
+def ParseHeader(data):
+    """Walk the marker segments of a JPEG in a buffer, e.g. an mmap, up to
+    the first start of frame. The segments are parsed through memoryviews,
+    so nothing but the fields wanted is copied."""
+    header = JpegHeader()
+    with memoryview(data) as view:
+        if view[0:2] != b'\xff\xd8':
+            return header
+        pos = 2
+        while pos + 4 <= len(view):
+            if view[pos] != 0xff:
+                break
+            marker = view[pos + 1]
+            if marker == 0xff:      # Fill byte.
+                pos += 1
+                continue
+            if marker in STANDALONE_MARKERS:
+                pos += 2
+                continue
+            if marker in (0xda, 0xd9):  # Start of scan or end of image.
+                break
+            length = struct.unpack_from('>H', view, pos + 2)[0]
+            body = pos + 4
+            if marker == 0xe1 and header.exif is None and \
+                    view[body:body + 6] == b'Exif\x00\x00':
+                with view[body + 6:pos + 2 + length] as tiff:
+                    try:
+                        header.exif = ParseExif(tiff)
+                        thumbnail = ExifThumbnail(tiff)
+                        orientation = OrientationOffset(tiff)
+                    except struct.error:
+                        thumbnail = orientation = None
+                if thumbnail:
+                    header.thumbnail = (body + 6 + thumbnail[0], thumbnail[1])
+                if orientation:
+                    header.orientation_at = (
+                            body + 6 + orientation[0], orientation[1])
+            elif marker in SOF_MARKERS:
+                height, width = struct.unpack_from('>HH', view, body + 1)
+                header.size = (width, height)
+                break
+            pos += 2 + length
+    return header
+
+def ReadHeader(image_path):
+    """Return the JpegHeader of an image, memory mapping the file so only
+    the pages holding its marker segments are read."""
+    with open(image_path, 'rb') as fp:
+        try:
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):   # Empty, or can not be mapped.
+            return JpegHeader()
+    with mapped:
+        try:
+            return ParseHeader(mapped)
+        except struct.error:
+            return JpegHeader()
+
+def ReadExif(image_path):
+    """Return the ExifInfo for an image, empty if it has none or it can not
+    be parsed."""
+    return ReadHeader(image_path).exif or ExifInfo()
+
+def ReadExifThumbnail(image_path):
+    """Return the JPEG thumbnail embedded in the EXIF data of an image as
+    bytes, or None if there is not one."""
+    thumbnail = ReadHeader(image_path).thumbnail
+    if thumbnail is None:
+        return None
+    offset, length = thumbnail
+    with open(image_path, 'rb') as fp:
+        fp.seek(offset)
+        return fp.read(length)
+
+def WriteOrientation(image_path, orientation):
+    """Set the Orientation tag of a JPEG in place. Returns False if it has
+    no Orientation tag to set."""
+    at = ReadHeader(image_path).orientation_at
+    if at is None:
+        return False
+    offset, endian = at
+    with open(image_path, 'r+b') as fp:
+        fp.seek(offset)
+        fp.write(struct.pack(endian + 'H', orientation))
+    return True
+
+def CaptureTime(image_path, index=None, st=None):
+    """Return the datetime an image was taken from its EXIF data, looked up
+    in the MetadataIndex 'index' if given. Falls back to the creation time of
+    the file if there is no EXIF date."""
+    if st is None:
+        st = os.stat(image_path)
+    info = index.get(image_path, st) if index else ReadExif(image_path)
+    return info.capture_time() or datetime.fromtimestamp(st.st_ctime)
+
+class MetadataIndex(object):
+    """On disk index of ExifInfo keyed by image path, valid while the size
+    and modification time of the image are unchanged."""
+
+    COMMIT_EVERY = 100
+
+    def __init__(self, filename):
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute(
+                'CREATE TABLE IF NOT EXISTS exif ('
+                'path TEXT PRIMARY KEY, size INTEGER, mtime REAL, '
+                'datetime TEXT, subsec TEXT, model TEXT, orientation INTEGER)')
+
+    def get(self, image_path, st=None):
+        """Return the ExifInfo for the image, only reading the file if it is
+        new or has changed. 'st' is an os.stat result if already known."""
+        if st is None:
+            st = os.stat(image_path)
+        with self.lock:
+            row = self.db.execute(
+                    'SELECT size, mtime, datetime, subsec, model, orientation '
+                    'FROM exif WHERE path = ?', (image_path,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime:
+            return ExifInfo(*row[2:])
+
+        info = ReadExif(image_path)
+        with self.lock:
+            self.db.execute(
+                    'INSERT OR REPLACE INTO exif VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (image_path, st.st_size, st.st_mtime, info.datetime,
+                        info.subsec, info.model, info.orientation))
+            self.pending += 1
+            if self.pending >= self.COMMIT_EVERY:
+                self.db.commit()
+                self.pending = 0
+        return info
+
+    def flush(self):
+        """Commit the entries added since the last commit, so a long running
+        process does not keep the database locked."""
+        with self.lock:
+            self.db.commit()
+            self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
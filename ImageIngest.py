@@ -0,0 +1,236 @@
+"""Ingest several cards at once, e.g. from two or three card readers.
+
+Each physical device gets one reader lane which reads its images one at a
+time, so reads from the same flash card never contend with each other, while
+different cards are read in parallel. The images read are handed to a pool of
+writers shared by every lane, which write them to the destination. Total time
+is then bounded by the slowest card rather than the sum of all of them."""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ImageBatch import BUFFER_SIZE, BuildCopyJobs, CopyStats, ReadFile, \
+        WriteFile
+from ImageStats import STATS, Timer
+
+READ_AHEAD_MB = 256     # Most image data read but not yet written.
+
+def DeviceOf(path):
+    """The device a file or folder is on."""
+    return os.stat(path).st_dev
+
+def BuildIngestJobs(sources, destination, options, metadata=None,
+        journal=None):
+    """Return a list of (source, jobs) from a list of (source, images).
+    Names are given in one pass, so two cards with an IMG_0001.JPG each do
+    not both copy it to the same name. Names the 'journal' has are kept, as
+    by BuildCopyJobs."""
+    images = [image for source, source_images in sources
+            for image in source_images]
+    jobs = BuildCopyJobs(images, destination, options, metadata, journal)
+    result = []
+    for source, source_images in sources:
+        result.append((source, jobs[:len(source_images)]))
+        jobs = jobs[len(source_images):]
+    return result
+
+class IngestSource(object):
+    """A source being ingested: its CopyJobs and their CopyStats."""
+
+    def __init__(self, source, jobs):
+        self.source = source
+        self.jobs = jobs
+        self.stats = CopyStats(len(jobs), sum(job.size for job in jobs))
+
+class IngestScheduler(object):
+    """Copy the jobs of several sources with one reader lane per device and
+    'writers' threads writing to the destination.
+
+    'progress' is called with (source, job, stats of the source, total stats)
+    after each file is written, from a writer thread holding the lock which
+    keeps the counts consistent. The journal and
+    DuplicateIndex are used as by BatchCopier, except that copies are not
+    resumed as whole files are read into memory. 'rewrite' and 'derive' are
+    called with each job written, as by BatchCopier."""
+
+    def __init__(self, writers=4, progress=None, journal=None, dupes=None,
+            verify=True, buffer_size=BUFFER_SIZE, read_ahead_mb=READ_AHEAD_MB,
+            derive=None, rewrite=None):
+        self.writers = max(1, int(writers))
+        self.progress = progress
+        self.journal = journal
+        self.dupes = dupes
+        self.verify = verify
+        self.buffer_size = buffer_size
+        self.derive = derive
+        self.rewrite = rewrite
+        self.read_ahead = int(read_ahead_mb * 1024 * 1024)
+        self.in_flight = 0      # Bytes read and waiting to be written.
+        self.cond = threading.Condition()
+        self.lock = threading.Lock()
+        self.sources = []
+        self.total = CopyStats()
+        self.cancelled = False
+
+    def cancel(self):
+        """Stop reading new images, those already read are written."""
+        with self.cond:
+            self.cancelled = True
+            self.cond.notify_all()
+
+    def lanes(self):
+        """The sources grouped by the device they are on, in order."""
+        lanes = {}
+        for source in self.sources:
+            try:
+                device = DeviceOf(source.source)
+            except OSError:
+                device = source.source
+            lanes.setdefault(device, []).append(source)
+        return list(lanes.values())
+
+    def _reserve(self, nbytes):
+        """Wait until 'nbytes' more can be held in memory. A single image
+        larger than the whole read ahead is let through on its own."""
+        with self.cond:
+            while not self.cancelled and self.in_flight and \
+                    self.in_flight + nbytes > self.read_ahead:
+                self.cond.wait()
+            self.in_flight += nbytes
+            return not self.cancelled
+
+    def _release(self, nbytes):
+        with self.cond:
+            self.in_flight -= nbytes
+            self.cond.notify_all()
+
+    def _error(self, source, job, err):
+        with self.lock:
+            source.stats.errors.append((job, err))
+            self.total.errors.append((job, err))
+            self._finished(source)
+
+    def _finished(self, source):
+        """Stop the clock of a source once all its jobs are accounted for."""
+        stats = source.stats
+        if stats.files + stats.skipped + len(stats.duplicates) + \
+                len(stats.errors) >= stats.total_files:
+            stats.stop = stats.stop or time.time()
+
+    def _read(self, lane, pool):
+        """Read the images of the sources on one device, in order."""
+        for source in lane:
+            for job in source.jobs:
+                if self.cancelled:
+                    return
+                if self._skip(source, job):
+                    continue
+                if not self._reserve(job.size):
+                    self._release(job.size)
+                    return
+                try:
+                    with Timer('ingest read'):
+                        data, digest = ReadFile(job.source)
+                except (IOError, OSError) as err:
+                    self._release(job.size)
+                    self._error(source, job, err)
+                    continue
+                pool.submit(self._write, source, job, data, digest)
+
+    def _skip(self, source, job):
+        """True if the journal or library says the job is already done."""
+        if self.journal is not None and job.key and \
+                self.journal.is_done(job.key):
+            with self.lock:
+                source.stats.skipped += 1
+                self.total.skipped += 1
+                self._finished(source)
+            return True
+        if self.dupes is None:
+            return False
+        try:
+            duplicate = self.dupes.find(job.source, job.size)
+        except (IOError, OSError) as err:
+            self._error(source, job, err)
+            return True
+        if duplicate is None:
+            return False
+        if self.journal is not None and job.key:
+            self.journal.record(job.key, job.source, duplicate, job.size, None)
+        with self.lock:
+            source.stats.duplicates.append((job, duplicate))
+            self.total.duplicates.append((job, duplicate))
+            self._finished(source)
+        return True
+
+    def _write(self, source, job, data, digest):
+        journal = self.journal if job.key else None
+        try:
+            if journal is not None:
+                journal.start(job.key, job.source, job.destination)
+            with Timer('ingest write'):
+                nbytes, digest = WriteFile(
+                        data, job.destination, digest, self.verify,
+                        job.source, self.buffer_size)
+            STATS.incr('copy bytes', nbytes)
+            copied = None
+            if self.rewrite:
+                rewritten = self.rewrite(job)
+                if rewritten is not None:
+                    copied = (nbytes, digest) if digest else None
+                    nbytes, digest = rewritten
+            if journal is not None:
+                journal.record(
+                        job.key, job.source, job.destination, nbytes, digest)
+            if self.dupes is not None:
+                self.dupes.add(job.destination, nbytes, digest, copied)
+        except (IOError, OSError) as err:
+            self._error(source, job, err)
+            return
+        finally:
+            self._release(job.size)
+
+        with self.lock:
+            for stats in (source.stats, self.total):
+                stats.files += 1
+                stats.bytes += nbytes
+            self._finished(source)
+            if self.progress:
+                self.progress(source.source, job, source.stats, self.total)
+        if self.derive:
+            self.derive(job)
+
+    def copy(self, sources):
+        """Copy a list of (source, jobs) as from BuildIngestJobs. Returns the
+        total CopyStats; those of each source are in 'sources'."""
+        self.sources = [IngestSource(source, jobs) for source, jobs in sources]
+        self.total = CopyStats(
+                sum(s.stats.total_files for s in self.sources),
+                sum(s.stats.total_bytes for s in self.sources))
+
+        with ThreadPoolExecutor(self.writers, 'IngestWrite') as pool:
+            readers = [
+                    threading.Thread(
+                        target=self._read, args=(lane, pool),
+                        name='IngestRead-{}'.format(i))
+                    for i, lane in enumerate(self.lanes())]
+            for reader in readers:
+                reader.start()
+            for reader in readers:
+                reader.join()
+
+        now = time.time()
+        for source in self.sources:
+            source.stats.stop = source.stats.stop or now
+        self.total.stop = now
+        return self.total
+
+    def summary(self):
+        """A line of progress for each source then one for the total."""
+        with self.lock:
+            lines = [
+                    "{}: {}".format(source.source, source.stats)
+                    for source in self.sources]
+            lines.append("Total: {}".format(self.total))
+        return lines
@@ -0,0 +1,89 @@
+"""Journal of the copies made by ImageCopy, so an interrupted ingest can be
+restarted without copying again the images which already landed."""
+
+import os
+import sqlite3
+import threading
+import time
+
+def SourceKey(image_path, st=None):
+    """Identity of a source image which survives the card being mounted at a
+    different path: its file name, size and modification time."""
+    if st is None:
+        st = os.stat(image_path)
+    return '{}|{}|{}'.format(
+            os.path.basename(image_path), st.st_size, int(st.st_mtime))
+
+class CopyJournal(object):
+    """Record of started and completed copies kept in an SQLite database.
+
+    Every entry is held in memory as well, so checking whether a source
+    has already been copied is a dictionary lookup."""
+
+    def __init__(self, filename):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute(
+                'CREATE TABLE IF NOT EXISTS copies ('
+                'key TEXT PRIMARY KEY, source TEXT, destination TEXT, '
+                'size INTEGER, hash TEXT, done INTEGER, time REAL)')
+        self.db.commit()
+        self._entries = None
+
+    @property
+    def entries(self):
+        """{key: (destination, done)} for every copy, read from the database
+        the first time it is needed rather than when the journal is opened,
+        as a long journal takes a while to read."""
+        if self._entries is None:
+            with self.lock:
+                if self._entries is None:
+                    self._entries = dict(
+                            (key, (destination, done))
+                            for key, destination, done in self.db.execute(
+                                'SELECT key, destination, done FROM copies'))
+        return self._entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def is_done(self, key):
+        """True if the source identified by 'key' has been copied and the copy
+        is still where it was made. An image whose copy has since been moved
+        or deleted is copied again."""
+        entry = self.entries.get(key)
+        return bool(entry and entry[1]) and os.path.exists(entry[0])
+
+    def is_partial(self, key, destination):
+        """True if a copy of 'key' to 'destination' was started but did not
+        complete, so its part file can be resumed."""
+        return self.entries.get(key) == (destination, 0)
+
+    def destination(self, key):
+        entry = self.entries.get(key)
+        return entry[0] if entry else None
+
+    def start(self, key, source, destination):
+        """Record that a copy is about to start."""
+        if self.is_partial(key, destination):
+            return
+        self._write(key, source, destination, None, None, 0)
+
+    def record(self, key, source, destination, size, digest):
+        """Record a completed copy."""
+        self._write(key, source, destination, size, digest, 1)
+
+    def _write(self, key, source, destination, size, digest, done):
+        entries = self.entries
+        with self.lock:
+            self.db.execute(
+                    'INSERT OR REPLACE INTO copies VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (key, source, destination, size, digest, done, time.time()))
+            self.db.commit()
+            entries[key] = (destination, done)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,104 @@
+"""Turn images the right way up, as the EXIF Orientation tag says.
+
+Cameras store a portrait shot sideways and record which way up it was held
+in the Orientation tag. For display an image is turned once, after the
+reduced decode and before it is cached, so zooming and browsing never turn
+it again. Copies can also be turned losslessly with jpegtran, which moves
+the DCT blocks about rather than decoding and encoding the image again, and
+then have their Orientation tag set to 1. A copy is turned before it is
+recorded in the journal and library, so they describe it as it is on disk."""
+
+import os
+import shutil
+import subprocess
+import threading
+from PIL import Image
+from ImageDupes import FullHash
+from ImageExif import ReadHeader, WriteOrientation
+from ImageStats import STATS, Timer
+
+UPRIGHT = 1
+
+# How to turn an image stored with each orientation the right way up.
+TRANSPOSE = {
+        2: Image.FLIP_LEFT_RIGHT,
+        3: Image.ROTATE_180,
+        4: Image.FLIP_TOP_BOTTOM,
+        5: Image.TRANSPOSE,
+        6: Image.ROTATE_270,
+        7: Image.TRANSVERSE,
+        8: Image.ROTATE_90,
+        }
+JPEGTRAN_ARGS = {
+        2: ['-flip', 'horizontal'],
+        3: ['-rotate', '180'],
+        4: ['-flip', 'vertical'],
+        5: ['-transpose'],
+        6: ['-rotate', '90'],
+        7: ['-transverse'],
+        8: ['-rotate', '270'],
+        }
+
+def ReadOrientation(image_path):
+    """The Orientation of an image, UPRIGHT if it has none."""
+    exif = ReadHeader(image_path).exif
+    return exif.orientation if exif and exif.orientation in TRANSPOSE \
+            else UPRIGHT
+
+def OrientedSize(size, orientation):
+    """The (width, height) of an image of 'size' once turned upright."""
+    if orientation in (5, 6, 7, 8):
+        return size[1], size[0]
+    return size
+
+def OrientImage(image, orientation):
+    """The image turned the right way up, or itself if it already is."""
+    method = TRANSPOSE.get(orientation)
+    if method is None:
+        return image
+    with Timer('orient'):
+        return image.transpose(method)
+
+def RotateLossless(image_path, jpegtran=None):
+    """Turn a JPEG upright in place with jpegtran and set its Orientation
+    tag to 1. Returns False, leaving the file alone, if it is upright
+    already, jpegtran is not installed, or the image is not a whole number
+    of blocks wide and high so its edges could not be turned losslessly.
+
+    The EXIF thumbnail and the pixel dimensions in the EXIF data are copied
+    as they were."""
+    header = ReadHeader(image_path)
+    args = JPEGTRAN_ARGS.get(header.exif.orientation if header.exif else None)
+    if args is None or header.orientation_at is None:
+        return False
+    jpegtran = jpegtran or shutil.which('jpegtran')
+    if jpegtran is None:
+        return False
+
+    temp = '{}.{}.rot'.format(image_path, threading.get_ident())
+    try:
+        with Timer('rotate'):
+            result = subprocess.run(
+                    [jpegtran, '-copy', 'all', '-perfect'] + args +
+                    ['-outfile', temp, image_path],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if result.returncode != 0 or not WriteOrientation(temp, UPRIGHT):
+            return False
+        os.replace(temp, image_path)
+        return True
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+def RotateCopied(job):
+    """Rewrite hook for BatchCopier and IngestScheduler: turn each copy
+    upright. Returns the (size, digest) of the copy once turned, or None if
+    it was left as it was."""
+    try:
+        if not RotateLossless(job.destination):
+            return None
+        STATS.incr('rotated')
+        return os.path.getsize(job.destination), FullHash(job.destination)
+    except (IOError, OSError):
+        STATS.incr('rotate failed')
+        return None
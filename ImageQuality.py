@@ -0,0 +1,202 @@
+"""Score images for focus and exposure, so that the clearly good frames can
+be selected and the clearly bad ones left out, and only the borderline ones
+need a look.
+
+Each image is decoded in draft mode to about QUALITY_SIZE and measured with
+NumPy over the whole array at once:
+
+* focus, the variance of the Laplacian. Soft or shaken images have few sharp
+  edges, so a low variance.
+* dark and bright, the fractions of pixels clipped to black or white.
+* motion, the weaker of the horizontal and vertical gradient energies over
+  the stronger. Motion blur smears edges along one direction, so a low ratio.
+
+Measuring is done in a pool of processes, as decoding holds the GIL, and the
+results are kept in a QualityIndex on disk so each image is measured once.
+Blinks are not looked for, as that needs a face and eye detector."""
+
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from ImageCache import DecodeImage
+from ImageStats import Timer
+
+QUALITY_SIZE = (640, 480)
+CLIP_LOW = 2            # Grey levels at or below this are clipped black.
+CLIP_HIGH = 253         # Grey levels at or above this are clipped white.
+
+# Thresholds between good, borderline and reject, for images at QUALITY_SIZE.
+FOCUS_REJECT = 20.0
+FOCUS_GOOD = 100.0
+CLIP_GOOD = 0.02
+CLIP_REJECT = 0.25
+MOTION_GOOD = 0.35
+
+GOOD = 'good'
+BORDERLINE = 'borderline'
+REJECT = 'reject'
+
+class Quality(object):
+    """What was measured of an image, as described above."""
+    __slots__ = ('focus', 'dark', 'bright', 'motion')
+
+    def __init__(self, focus, dark, bright, motion):
+        self.focus = focus
+        self.dark = dark
+        self.bright = bright
+        self.motion = motion
+
+    def assess(self):
+        """Return (verdict, list of the problems found), the verdict being
+        GOOD, BORDERLINE or REJECT."""
+        rejects = []
+        problems = []
+        if self.focus < FOCUS_REJECT:
+            rejects.append('blurred')
+        elif self.focus < FOCUS_GOOD:
+            problems.append('soft')
+        for name, clipped in (('dark', self.dark), ('bright', self.bright)):
+            if clipped > CLIP_REJECT:
+                rejects.append(name)
+            elif clipped > CLIP_GOOD:
+                problems.append(name)
+        if self.motion < MOTION_GOOD:
+            problems.append('motion')
+        if rejects:
+            return REJECT, rejects + problems
+        return (BORDERLINE if problems else GOOD), problems
+
+    def score(self):
+        """A single figure to sort by, higher is better: the focus, less for
+        each fraction of the image clipped."""
+        return self.focus * (1.0 - min(1.0, self.dark + self.bright))
+
+    def __str__(self):
+        verdict, problems = self.assess()
+        if problems:
+            verdict = "{}: {}".format(verdict, ', '.join(problems))
+        return "{} ({:.0f})".format(verdict, self.focus)
+
+def GreyArray(image_path, size=QUALITY_SIZE):
+    """A draft decode of the image at least 'size', as a float32 array of
+    grey levels."""
+    import numpy as np
+    return np.asarray(
+            DecodeImage(image_path, fit=size).convert('L'), dtype=np.float32)
+
+def Focus(grey):
+    """Variance of the Laplacian of a grey level array. Higher is sharper."""
+    laplacian = (
+            grey[:-2, 1:-1] + grey[2:, 1:-1] + grey[1:-1, :-2] +
+            grey[1:-1, 2:] - 4 * grey[1:-1, 1:-1])
+    return float(laplacian.var())
+
+def Clipping(grey):
+    """(dark, bright), the fractions of a grey level array clipped to black
+    and to white, from its histogram."""
+    import numpy as np
+    counts = np.bincount(grey.astype(np.uint8).ravel(), minlength=256)
+    total = float(grey.size) or 1.0
+    return (float(counts[:CLIP_LOW + 1].sum()) / total,
+            float(counts[CLIP_HIGH:].sum()) / total)
+
+def Motion(grey):
+    """The weaker of the mean squared horizontal and vertical gradients over
+    the stronger, from 0 for blur all in one direction to 1."""
+    import numpy as np
+    dx = float(np.square(np.diff(grey, axis=1)).mean())
+    dy = float(np.square(np.diff(grey, axis=0)).mean())
+    strongest = max(dx, dy)
+    return min(dx, dy) / strongest if strongest else 1.0
+
+def MeasureImage(image_path, size=QUALITY_SIZE):
+    """The Quality of an image, or None if it cannot be decoded. Runs in a
+    worker process."""
+    try:
+        grey = GreyArray(image_path, size)
+    except (IOError, OSError, SyntaxError):
+        return None
+    dark, bright = Clipping(grey)
+    return Quality(Focus(grey), dark, bright, Motion(grey))
+
+class QualityIndex(object):
+    """On disk index of the Quality of each image keyed by its path, valid
+    while the size and modification time of the image are unchanged."""
+
+    COMMIT_EVERY = 100
+
+    def __init__(self, filename):
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute(
+                'CREATE TABLE IF NOT EXISTS quality ('
+                'path TEXT PRIMARY KEY, size INTEGER, mtime REAL, '
+                'focus REAL, dark REAL, bright REAL, motion REAL)')
+
+    def get(self, image_path, st):
+        """The Quality of the image if measured since it last changed, else
+        None. 'st' is its os.stat result."""
+        with self.lock:
+            row = self.db.execute(
+                    'SELECT size, mtime, focus, dark, bright, motion '
+                    'FROM quality WHERE path = ?', (image_path,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime:
+            return Quality(*row[2:])
+        return None
+
+    def put(self, image_path, st, quality):
+        with self.lock:
+            self.db.execute(
+                    'INSERT OR REPLACE INTO quality VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (image_path, st.st_size, st.st_mtime, quality.focus,
+                        quality.dark, quality.bright, quality.motion))
+            self.pending += 1
+            if self.pending >= self.COMMIT_EVERY:
+                self.db.commit()
+                self.pending = 0
+
+    def flush(self):
+        with self.lock:
+            self.db.commit()
+            self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+def ScoreImages(images, index=None, workers=None):
+    """The Quality of each of a list of image paths, None for those which
+    cannot be read. Images not in the QualityIndex 'index' are measured in
+    a pool of 'workers' processes, by default one per core."""
+    results = [None] * len(images)
+    stats = {}
+    todo = []
+    for number, image in enumerate(images):
+        try:
+            st = os.stat(image)
+        except OSError:
+            continue
+        quality = index.get(image, st) if index is not None else None
+        if quality is None:
+            stats[number] = st
+            todo.append(number)
+        else:
+            results[number] = quality
+    if not todo:
+        return results
+
+    workers = max(1, int(workers or os.cpu_count() or 1))
+    with Timer('quality'), ProcessPoolExecutor(workers) as pool:
+        measured = pool.map(
+                MeasureImage, [images[number] for number in todo],
+                chunksize=max(1, min(16, len(todo) // (4 * workers))))
+        for number, quality in zip(todo, measured):
+            results[number] = quality
+            if quality is not None and index is not None:
+                index.put(images[number], stats[number], quality)
+    if index is not None:
+        index.flush()
+    return results
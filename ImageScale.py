@@ -1,4 +1,5 @@
 import sys
+from functools import partial
 if sys.version_info[0] > 2:
     import tkinter.font as tkFont
     from tkinter import *
@@ -7,6 +8,13 @@ else:
     import tkFont
     from Tkinter import *
 from PIL import Image, ImageTk
+from ImageCache import DecodeImage, ImageSize
+from ImageOrient import OrientImage, OrientedSize, ReadOrientation, UPRIGHT
+from ImageStats import Timer
+
+TILE_SIZE = 256     # Width and height of a tile in pixels.
+TILE_RATIO = 4      # Tile images with more than this many canvases of pixels.
+RESIZE_DELAY = 150  # Milliseconds without a resize before a full render.
 
 def invfrange(start, stop, step):
     """Inverted (reverse) range inclusive of the final stop value, designed 
@@ -19,9 +27,19 @@ def invfrange(start, stop, step):
     vrange.append(stop)
     return vrange
 
+def NearestImage(images, size):
+    """Return the smallest of 'images' which is at least 'size', or None."""
+    covering = [
+            im for im in images
+            if im.size[0] >= size[0] and im.size[1] >= size[1]]
+    if not covering:
+        return None
+    return min(covering, key=lambda im: im.size[0])
+
 class ImageCanvas:
-    def __init__(self, root):
+    def __init__(self, root, tasks=None):
         self.root = root
+        self.tasks = tasks  # TaskRunner to render zoom levels in the background.
         self.image_id = None
         self.scale_range = []
 
@@ -34,11 +52,13 @@ class ImageCanvas:
                 bg='black', 
                 width=800, 
                 height=600,
-                xscrollcommand=self.hsb.set,
-                yscrollcommand=self.vsb.set
+                xscrollcommand=self.xscroll,
+                yscrollcommand=self.yscroll
                 )
         self.canvas.pack(side=TOP, fill='both', expand='yes')
         self.canvas.update()
+        self.canvas_size = (
+                self.canvas.winfo_width(), self.canvas.winfo_height())
         
         self.hsb.configure(command=self.canvas.xview)
         self.vsb.configure(command=self.canvas.yview)
@@ -47,17 +67,119 @@ class ImageCanvas:
         self.canvas.bind('<Leave>', self.leave)
         self.canvas.bind('<Configure>', self.resize)
 
-        self.image = None
+        self.image_path = None
+        self.image_size = None      # Once turned upright.
+        self.orientation = UPRIGHT
+        self.decodes = {}
+        self.levels = {}
         self.scale_idx = 0
         self.scale_range = []
 
-    def load_image(self, image_path):
-        """Load the image indicated"""
-        self.image = Image.open(image_path)
-        self.calc_scale_range(self.image.size)
+        # Tiled rendering of large zoom levels, only the visible tiles exist.
+        self.tiles = {}
+        self.tile_image = None
+        self.tile_origin = (0, 0)
+        self.tile_job = None
+        self.resize_job = None
+
+    def load_image(self, image_path, image=None, image_size=None,
+            orientation=None):
+        """Load the image indicated. 'image' is an optional decode of it,
+        possibly reduced in size and already turned upright, that has been
+        made, and 'image_size' its full size as stored and 'orientation' its
+        EXIF orientation if already known. Every decode and zoom level is
+        kept upright, so the image is only turned when it is decoded."""
+        self.image_path = image_path
+        if image_size is None:
+            image_size = ImageSize(image_path)
+        if orientation is None:
+            orientation = ReadOrientation(image_path)
+        self.orientation = orientation
+        self.image_size = OrientedSize(image_size, orientation)
+        self.decodes = {}
+        self.levels = {}
+        if image is not None:
+            self.decodes[self.decode_factor(image)] = image
+        self.calc_scale_range(self.image_size)
         self.scale_idx = len(self.scale_range)-1
         self.show_image()
 
+    def unload_image(self):
+        """Show no image, e.g. when the one asked for could not be read."""
+        self.clear_image()
+        self.image_path = None
+        self.image_size = None
+        self.decodes = {}
+        self.levels = {}
+        self.scale_idx = 0
+        self.scale_range = []
+
+    def decode_factor(self, image):
+        """The reduction factor of a decode compared to the full image."""
+        return max(1, int(round(float(self.image_size[0]) / image.size[0])))
+
+    def cached(self):
+        """Every level and decode of the image held."""
+        return list(self.levels.values()) + list(self.decodes.values())
+
+    def make_level(self, image_path, image_size, scale, cached,
+            orientation=UPRIGHT):
+        """Return the image resized to 'scale', and the new decode it was
+        made from or None. 'image_size' is the upright size, and a new
+        decode is turned upright before being resized. Safe to call from a
+        worker thread.
+
+        A level is resampled from the smallest of the 'cached' images that
+        is still larger than it, not from the full size image, so stepping
+        through the zoom levels gets cheaper as it goes. Only when none is
+        large enough is the image decoded again, which needs a full size
+        decode only when zooming past 1/2 size."""
+        width, height = image_size
+        size = (int(width * scale), int(height * scale))
+        decode = None
+        source = NearestImage(cached, size)
+        if source is None:
+            source = decode = OrientImage(
+                    DecodeImage(image_path, scale), orientation)
+
+        image = source
+        if source.size != size:
+            with Timer('resize'):
+                image = source.resize(size, Image.LANCZOS)
+        return image, decode
+
+    def add_level(self, scale, image, decode=None):
+        self.levels[scale] = image
+        if decode is not None:
+            self.decodes[self.decode_factor(decode)] = decode
+
+    def level(self, scale):
+        """Return the image resized to 'scale' from the zoom pyramid."""
+        image = self.levels.get(scale)
+        if image is None:
+            image, decode = self.make_level(
+                    self.image_path, self.image_size, scale, self.cached(),
+                    self.orientation)
+            self.add_level(scale, image, decode)
+        return image
+
+    def render_level(self, scale):
+        """Make the zoom level in the background and show it when done. The
+        image currently shown stays up meanwhile."""
+        self.canvas.configure(cursor='watch')
+        self.tasks.submit(
+                'zoom level', self.make_level,
+                (self.image_path, self.image_size, scale, self.cached(),
+                    self.orientation),
+                partial(self.level_done, self.image_path, scale))
+
+    def level_done(self, image_path, scale, result):
+        if image_path != self.image_path or scale not in self.scale_range:
+            return
+        self.add_level(scale, *result)
+        if scale == self.scale_range[self.scale_idx]:
+            self.show_image()
+
     def move_from(self, event):
         ''' Remember previous coordinates for scrolling with the mouse '''
         self.canvas.scan_mark(event.x, event.y)
@@ -104,28 +226,99 @@ class ImageCanvas:
         #        )
 
     def show_image(self):
-        """Show image on the canvas"""
-        if self.image_id:
-            self.canvas.delete(self.image_id)
+        """Show image on the canvas. With a TaskRunner, a zoom level which
+        has not been made yet is rendered in the background first."""
+        scale = self.scale_range[self.scale_idx]
+        image = self.levels.get(scale)
+        if image is None:
+            if self.tasks is not None:
+                self.render_level(scale)
+                return
+            image = self.level(scale)
+        self.clear_image()
+        self.canvas.configure(cursor='')
 
-        width, height = self.image.size
+        width, height = self.image_size
         cw = self.canvas.winfo_width()
         ch = self.canvas.winfo_height()
-
-        nw = int(width * self.scale_range[self.scale_idx])
-        nh = int(height * self.scale_range[self.scale_idx])
-        self.imagetk = ImageTk.PhotoImage(
-                self.image.resize( (nw, nh), Image.ANTIALIAS )
-                )
+        nw = int(width * scale)
+        nh = int(height * scale)
 
         ow = (cw - nw) / 2 if nw < cw else 0
         oh = (ch - nh) / 2 if nh < ch else 0
 
-        self.image_id = self.canvas.create_image(ow , oh, image=self.imagetk, anchor='nw')
-        self.canvas.configure(scrollregion=self.canvas.bbox('all'))
+        if nw * nh > TILE_RATIO * cw * ch:
+            self.tile_image = image
+            self.tile_origin = (ow, oh)
+            self.canvas.configure(scrollregion=(0, 0, ow + nw, oh + nh))
+            self.update_tiles()
+        else:
+            with Timer('photoimage'):
+                self.imagetk = ImageTk.PhotoImage(image)
+            self.image_id = self.canvas.create_image(ow , oh, image=self.imagetk, anchor='nw')
+            self.canvas.configure(scrollregion=self.canvas.bbox('all'))
+
+    def clear_image(self):
+        """Remove the image, or all of its tiles, from the canvas."""
+        if self.image_id:
+            self.canvas.delete(self.image_id)
+            self.image_id = None
+        for item, photo in self.tiles.values():
+            self.canvas.delete(item)
+        self.tiles = {}
+        self.tile_image = None
+        self.imagetk = None
+
+    def xscroll(self, first, last):
+        self.hsb.set(first, last)
+        self.schedule_tiles()
+
+    def yscroll(self, first, last):
+        self.vsb.set(first, last)
+        self.schedule_tiles()
+
+    def schedule_tiles(self):
+        """Update the tiles once the current burst of scrolling is handled."""
+        if self.tile_image is not None and self.tile_job is None:
+            self.tile_job = self.canvas.after_idle(self.update_tiles)
+
+    def update_tiles(self):
+        """Create the tiles that intersect the visible part of the canvas,
+        with a margin of one tile, and delete all the others."""
+        self.tile_job = None
+        if self.tile_image is None:
+            return
+
+        ow, oh = self.tile_origin
+        iw, ih = self.tile_image.size
+        x0 = self.canvas.canvasx(0) - ow
+        y0 = self.canvas.canvasy(0) - oh
+        cw, ch = self.canvas_size
+
+        cols = range(
+                max(0, int(x0 // TILE_SIZE) - 1),
+                min((iw - 1) // TILE_SIZE, int((x0 + cw) // TILE_SIZE) + 1) + 1)
+        rows = range(
+                max(0, int(y0 // TILE_SIZE) - 1),
+                min((ih - 1) // TILE_SIZE, int((y0 + ch) // TILE_SIZE) + 1) + 1)
+        visible = set((col, row) for col in cols for row in rows)
+
+        for key in set(self.tiles) - visible:
+            self.canvas.delete(self.tiles.pop(key)[0])
+
+        for col, row in visible - set(self.tiles):
+            x, y = col * TILE_SIZE, row * TILE_SIZE
+            with Timer('photoimage tile'):
+                photo = ImageTk.PhotoImage(self.tile_image.crop(
+                    (x, y, min(x + TILE_SIZE, iw), min(y + TILE_SIZE, ih))))
+            item = self.canvas.create_image(
+                    ow + x, oh + y, image=photo, anchor='nw')
+            self.tiles[(col, row)] = (item, photo)
 
 
     def calc_scale_range(self, size):
+        """Zoom levels from actual size down to fitting the canvas, for an
+        image of 'size' once turned upright."""
         width, height = size
         cw = self.canvas.winfo_width()
         ch = self.canvas.winfo_height()
@@ -136,12 +329,56 @@ class ImageCanvas:
            wratio = float(cw) / width
            hratio = float(ch) / height
            min_scale = round( min(wratio, hratio), 4)
-        self.scale_range = invfrange(1.0, min_scale, 0.2)
+           self.scale_range = invfrange(1.0, min_scale, 0.2)
         self.scale_idx = len(self.scale_range) - 1
 
     def resize(self, event):
-        self.calc_scale_range(self.image.size)
-        self.scale_idx = len(self.scale_range)-1
+        """Handle a <Configure> event. A fast, low quality preview is shown
+        straight away and the full render waits until resizing has stopped
+        for RESIZE_DELAY milliseconds."""
+        size = (event.width, event.height)
+        if size == self.canvas_size:
+            return
+        self.canvas_size = size
+        if self.image_size is None:
+            return
+
+        if self.resize_job:
+            self.canvas.after_cancel(self.resize_job)
+        self.resize_job = self.canvas.after(RESIZE_DELAY, self.resize_done)
+        self.show_preview()
+
+    def show_preview(self):
+        """Fit the smallest cached image that covers the canvas to it, using
+        nearest neighbour resampling."""
+        self.clear_image()
+
+        width, height = self.image_size
+        cw, ch = self.canvas_size
+        scale = min(float(cw) / width, float(ch) / height, 1.0)
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+
+        cached = list(self.levels.values()) + list(self.decodes.values())
+        if not cached:
+            return
+        source = NearestImage(cached, size)
+        if source is None:
+            source = max(cached, key=lambda im: im.size[0])
+
+        self.imagetk = ImageTk.PhotoImage(source.resize(size, Image.NEAREST))
+        self.image_id = self.canvas.create_image(
+                (cw - size[0]) / 2, (ch - size[1]) / 2,
+                image=self.imagetk, anchor='nw')
+        self.canvas.configure(scrollregion=self.canvas.bbox('all'))
+
+    def resize_done(self):
+        """Full quality render once resizing has settled. Zoom levels which
+        are still in the scale range are kept."""
+        self.resize_job = None
+        self.calc_scale_range(self.image_size)
+        self.levels = dict(
+                (scale, image) for scale, image in self.levels.items()
+                if scale in self.scale_range)
         self.show_image()
 
     def get_zoom(self):
@@ -0,0 +1,67 @@
+"""Find the JPG images on a memory card laid out to the Design rule for Camera
+File system (DCF), e.g. DCIM/100CANON/IMG_0001.JPG, DCIM/101CANON/...
+
+Folders are listed one at a time with os.scandir, so the first images are
+available before the whole card has been enumerated."""
+
+import os
+
+JPG_EXTENSIONS = ('.jpg', '.jpeg')
+
+def IsJpg(name):
+    """True if the file name has a JPG extension, in any case."""
+    return os.path.splitext(name)[1].lower() in JPG_EXTENSIONS
+
+def ScanRoot(path):
+    """Return (root, recursive) for scanning 'path'. A card, or any folder
+    with a DCIM folder in it, is scanned from its DCIM folder down. A folder
+    inside a DCIM tree is scanned recursively, anything else is not."""
+    dcim = os.path.join(path, 'DCIM')
+    if os.path.isdir(dcim):
+        return dcim, True
+    parts = os.path.normpath(os.path.abspath(path)).upper().split(os.sep)
+    return path, 'DCIM' in parts
+
+def ScanJpgFolders(path, recursive=None, skip=()):
+    """Generator of (folder, entries) for each folder containing JPGs, in
+    DCF order. 'entries' are the os.DirEntry objects of the JPGs sorted by
+    name, with their stat results already fetched and cached. If
+    'recursive' is None it is chosen by ScanRoot. Folders named in 'skip'
+    are not looked in."""
+    if recursive is None:
+        path, recursive = ScanRoot(path)
+
+    stack = [path]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as it:
+                entries = list(it)
+        except OSError:
+            continue
+
+        jpgs = []
+        subdirs = []
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            try:
+                if entry.is_file() and IsJpg(entry.name):
+                    entry.stat()
+                    jpgs.append(entry)
+                elif recursive and entry.name not in skip and \
+                        entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+            except OSError:
+                continue
+
+        if jpgs:
+            jpgs.sort(key=lambda entry: entry.name)
+            yield folder, jpgs
+        stack.extend(sorted(subdirs, reverse=True))
+
+def ScanJpgFiles(path, recursive=None, skip=()):
+    """Generator of the os.DirEntry for every JPG found by ScanJpgFolders."""
+    for folder, entries in ScanJpgFolders(path, recursive, skip):
+        for entry in entries:
+            yield entry
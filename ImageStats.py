@@ -0,0 +1,109 @@
+"""Timing of the stages of showing and copying images: disk read, JPEG
+decode, resize, PhotoImage conversion and copy.
+
+Timings go into rolling histograms which the GUI can show, and a bounded
+trace of recent events which can be dumped to a JSON file in the Chrome
+trace event format (chrome://tracing, Perfetto)."""
+
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+class Histogram(object):
+    """The last 'size' timings of a stage, in seconds."""
+
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+        self.total = 0      # Count of every timing, not just those kept.
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.total += 1
+
+    def percentile(self, pct):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100.0))]
+
+    def summary(self):
+        """Count, mean, median, 90th percentile and max in milliseconds."""
+        samples = list(self.samples)
+        mean = sum(samples) / len(samples) if samples else 0.0
+        return dict(
+                count=self.total,
+                mean_ms=round(mean * 1000.0, 2),
+                p50_ms=round(self.percentile(50) * 1000.0, 2),
+                p90_ms=round(self.percentile(90) * 1000.0, 2),
+                max_ms=round(max(samples) * 1000.0 if samples else 0.0, 2))
+
+class Stats(object):
+    """Histograms and counters by stage name, safe to use from any thread."""
+
+    def __init__(self, size=200, trace_size=10000):
+        self.size = size
+        self.histograms = {}
+        self.counters = {}
+        self.events = deque(maxlen=trace_size)
+        self.lock = threading.Lock()
+        self.epoch = time.time() - time.perf_counter()
+
+    def add(self, name, seconds, start=None):
+        """Record that stage 'name' took 'seconds', starting at perf_counter
+        time 'start' if known."""
+        if start is None:
+            start = time.perf_counter() - seconds
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.size)
+            histogram.add(seconds)
+            self.events.append(
+                    (name, start, seconds, threading.current_thread().name))
+
+    def incr(self, name, count=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    @contextmanager
+    def timer(self, name):
+        """Context manager timing the code it wraps as stage 'name'."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, start)
+
+    def summary(self):
+        with self.lock:
+            stages = dict(
+                    (name, h.summary()) for name, h in self.histograms.items())
+            return dict(stages=stages, counters=dict(self.counters))
+
+    def dump(self, filename):
+        """Write the summary and the recent events to a JSON trace file."""
+        with self.lock:
+            events = list(self.events)
+        threads = {}
+        trace = []
+        for name, start, seconds, thread in events:
+            trace.append(dict(
+                name=name, ph='X', pid=1,
+                tid=threads.setdefault(thread, len(threads) + 1),
+                ts=int((self.epoch + start) * 1e6), dur=int(seconds * 1e6)))
+        for thread, tid in threads.items():
+            trace.append(dict(
+                name='thread_name', ph='M', pid=1, tid=tid,
+                args=dict(name=thread)))
+        with open(filename, 'w') as fp:
+            json.dump(dict(traceEvents=trace, summary=self.summary()), fp,
+                    indent=1)
+
+# The statistics for the whole application.
+STATS = Stats()
+
+def Timer(name):
+    """Time a stage into the application STATS."""
+    return STATS.timer(name)
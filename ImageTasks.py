@@ -0,0 +1,111 @@
+"""Run the slow parts of the GUI (listing folders, reading and decoding
+images, resizing and copying) on worker threads, handing the results back to
+the Tk thread through a queue which it polls with root.after.
+
+A task may be given a key. Submitting a new task with the same key makes the
+older one stale: it is cancelled if it has not started yet, and its result is
+dropped if it has. Pressing Next five times quickly therefore only decodes and
+shows the last image."""
+
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from ImageStats import STATS
+
+POLL_DELAY = 20     # Milliseconds between polls while tasks are outstanding.
+
+class TaskRunner(object):
+    """Pool of 'workers' threads whose results are delivered on the Tk thread
+    of 'root'. Only the Tk thread may submit or cancel tasks."""
+
+    def __init__(self, root, workers=2, name='TaskRunner'):
+        self.root = root
+        self.executor = ThreadPoolExecutor(workers, name)
+        self.results = queue.Queue()
+        self.generation = 0
+        self.latest = {}    # key: generation of the newest task with that key.
+        self.futures = {}   # key: future of the newest task with that key.
+        self.pending = 0    # Tasks submitted whose results are not yet handled.
+        self.poll_job = None
+        self.running = True
+
+    def submit(self, key, func, args=(), callback=None, errback=None):
+        """Run func(*args) on a worker, then callback(result) on the Tk
+        thread, or errback(exception) if it raised. A key of None means the
+        task never goes stale."""
+        self.generation += 1
+        if key is not None:
+            self._cancel(key)
+            self.latest[key] = self.generation
+        future = self.executor.submit(
+                self._run, key, self.generation, func, args, callback, errback)
+        if key is not None:
+            self.futures[key] = future
+        self.pending += 1
+        if self.poll_job is None:
+            self.poll_job = self.root.after(POLL_DELAY, self.poll)
+        return self.generation
+
+    def cancel(self, key):
+        """Make the task with 'key', if any, stale."""
+        self._cancel(key)
+        self.latest.pop(key, None)
+
+    def _cancel(self, key):
+        future = self.futures.pop(key, None)
+        if future is not None and future.cancel():
+            self.pending -= 1
+            STATS.incr('task cancelled')
+
+    def is_current(self, key, generation):
+        """False once a newer task with the same key has been submitted. Safe
+        to call from a worker so long tasks can give up early."""
+        return key is None or self.latest.get(key) == generation
+
+    def _run(self, key, generation, func, args, callback, errback):
+        result = error = None
+        if self.running and self.is_current(key, generation):
+            try:
+                result = func(*args)
+            except Exception as e:
+                error = e
+        self.results.put((key, generation, result, error, callback, errback))
+
+    def poll(self):
+        """Deliver the results of finished tasks which are still current."""
+        self.poll_job = None
+        try:
+            while self.running:
+                try:
+                    key, generation, result, error, callback, errback = \
+                            self.results.get_nowait()
+                except queue.Empty:
+                    break
+                self.pending -= 1
+                if not self.is_current(key, generation):
+                    STATS.incr('task stale')
+                    continue
+                if key is not None:
+                    del self.latest[key]
+                    self.futures.pop(key, None)
+                if error is not None:
+                    if errback:
+                        errback(error)
+                    else:
+                        self.root.report_callback_exception(
+                                type(error), error, error.__traceback__)
+                elif callback:
+                    callback(result)
+        finally:
+            if self.pending > 0 and self.running and self.poll_job is None:
+                self.poll_job = self.root.after(POLL_DELAY, self.poll)
+
+    def stop(self):
+        """Drop all outstanding work. Tasks already running are left to
+        finish, but their results are not delivered."""
+        self.running = False
+        if self.poll_job is not None:
+            self.root.after_cancel(self.poll_job)
+            self.poll_job = None
+        for key in list(self.futures):
+            self._cancel(key)
+        self.executor.shutdown(wait=False)
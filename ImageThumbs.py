@@ -0,0 +1,317 @@
+"""Contact sheet of thumbnails for finding an image without stepping through
+the card one full size image at a time.
+
+Thumbnails come from the EXIF data of each JPEG where there is one, without
+decoding the image, otherwise from a reduced size draft decode. They are
+kept in a cache on disk and made by a background worker, visible ones
+first."""
+
+import hashlib
+import io
+import os
+import queue
+import sys
+import threading
+if sys.version_info[0] > 2:
+    from tkinter import *
+else:
+    from Tkinter import *
+from PIL import Image, ImageTk
+from ImageCache import DecodeImage
+from ImageExif import ReadExifThumbnail
+from ImageOrient import OrientImage, ReadOrientation
+
+THUMB_SIZE = (160, 120)
+CELL_PAD = 10       # Pixels between thumbnails in the grid.
+THUMB_VERSION = 2   # Changed when thumbnails are made differently.
+
+def MakeThumbnail(image_path):
+    """Return a THUMB_SIZE thumbnail of an image, from its EXIF thumbnail if
+    it has one, turned upright."""
+    image = None
+    data = ReadExifThumbnail(image_path)
+    if data:
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        except (IOError, OSError, SyntaxError):
+            image = None
+    if image is None:
+        image = DecodeImage(image_path, fit=THUMB_SIZE)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image = OrientImage(image, ReadOrientation(image_path))
+    image.thumbnail(THUMB_SIZE)
+    return image
+
+class ThumbnailCache(object):
+    """Thumbnails stored as small JPEGs under 'directory', named by a hash
+    of the path, size and modification time of their image and of
+    THUMB_VERSION."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def filename(self, image_path):
+        st = os.stat(image_path)
+        key = hashlib.sha1('{}|{}|{}|{}'.format(
+            os.path.abspath(image_path), st.st_size, st.st_mtime,
+            THUMB_VERSION).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key[:2], key + '.jpg')
+
+    def ensure(self, image_path):
+        """Make and store the thumbnail if it is not cached. Returns the
+        thumbnail if it had to be made, else None."""
+        filename = self.filename(image_path)
+        if os.path.exists(filename):
+            return None
+        image = MakeThumbnail(image_path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        temp = '{}.{}.tmp'.format(filename, threading.get_ident())
+        image.save(temp, 'JPEG', quality=85)
+        os.replace(temp, filename)
+        return image
+
+    def get(self, image_path):
+        """Return the thumbnail of an image, making it if needed."""
+        image = self.ensure(image_path)
+        if image is None:
+            image = Image.open(self.filename(image_path))
+            image.load()
+        return image
+
+class ThumbnailLoader(object):
+    """Background worker which loads thumbnails for the visible cells and
+    then fills the disk cache for the rest of the images.
+
+    Loaded thumbnails are put on 'results' as (index, image path, image) to
+    be picked up by the Tk thread."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.results = queue.Queue()
+        self.visible = []
+        self.rest = []
+        self.running = True
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name='ThumbnailLoader')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, visible, rest):
+        """Replace the work to do. Both are lists of (index, image path),
+        'visible' ones are loaded and returned, 'rest' only cached."""
+        with self.cond:
+            self.visible = list(visible)
+            self.rest = list(rest)
+            self.cond.notify()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and not (self.visible or self.rest):
+                    self.cond.wait()
+                if not self.running:
+                    return
+                if self.visible:
+                    index, image_path = self.visible.pop(0)
+                    wanted = True
+                else:
+                    index, image_path = self.rest.pop(0)
+                    wanted = False
+            try:
+                if wanted:
+                    self.results.put(
+                            (index, image_path, self.cache.get(image_path)))
+                else:
+                    self.cache.ensure(image_path)
+            except (IOError, OSError, SyntaxError):
+                continue
+
+class ThumbnailGrid(object):
+    """Window showing the images in a scrolling grid of thumbnails. Clicking
+    a thumbnail calls 'command' with the index of its image.
+
+    'selected' is a set of image indexes shared with the caller. Control-click
+    toggles an image in it and Shift-click selects a range, after which
+    'select_command' is called."""
+
+    def __init__(self, root, images, cache, command=None, selected=None,
+            select_command=None):
+        self.images = images
+        self.command = command
+        self.selected = selected if selected is not None else set()
+        self.select_command = select_command
+        self.anchor = 0     # Where a Shift-click range starts.
+        self.outlines = {}  # index: canvas item outlining a selected image.
+        self.open = True
+        self.loader = ThumbnailLoader(cache)
+        self.photos = {}    # index: (canvas item, PhotoImage)
+        self.shown = 0      # Number of images the grid has been laid out for.
+        self.columns = 1
+        self.cell = (THUMB_SIZE[0] + CELL_PAD, THUMB_SIZE[1] + CELL_PAD)
+
+        self.top = Toplevel(root)
+        self.top.title("Contact Sheet")
+        self.vsb = Scrollbar(self.top, orient='vertical')
+        self.vsb.pack(side=RIGHT, fill=Y)
+        self.canvas = Canvas(
+                self.top, bg='black', width=6 * self.cell[0],
+                height=4 * self.cell[1], yscrollcommand=self.yscroll)
+        self.canvas.pack(side=LEFT, fill=BOTH, expand=YES)
+        self.vsb.configure(command=self.canvas.yview)
+
+        self.canvas.bind('<Configure>', self.layout)
+        self.canvas.bind('<ButtonPress-1>', self.click)
+        self.canvas.bind('<Control-ButtonPress-1>', self.toggle_click)
+        self.canvas.bind('<Shift-ButtonPress-1>', self.range_click)
+        self.canvas.bind('<MouseWheel>', self.wheel)
+        self.top.bind('<Destroy>', self.destroy)
+        self.poll()
+
+    def show(self, images, selected):
+        """Show another list of images, such as the same ones sorted another
+        way, with its set of selected indexes."""
+        self.images = images
+        self.selected = selected
+        self.anchor = 0
+        try:
+            while True:
+                self.loader.results.get_nowait()
+        except queue.Empty:
+            pass
+        self.layout()
+
+    def cell_origin(self, index):
+        row, col = divmod(index, self.columns)
+        return col * self.cell[0] + CELL_PAD // 2, row * self.cell[1] + CELL_PAD // 2
+
+    def layout(self, event=None):
+        """Fit as many columns as the window allows and size the scroll
+        region for all the images."""
+        width = self.canvas.winfo_width()
+        self.columns = max(1, width // self.cell[0])
+        self.shown = len(self.images)
+        rows = (self.shown + self.columns - 1) // self.columns
+        self.canvas.configure(
+                scrollregion=(0, 0, self.columns * self.cell[0], rows * self.cell[1]))
+        for item, photo in self.photos.values():
+            self.canvas.delete(item)
+        self.photos = {}
+        self.update_visible()
+        self.draw_selection()
+
+    def visible_range(self):
+        """Indexes of the images in the visible rows."""
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first = int(top // self.cell[1]) * self.columns
+        last = (int(bottom // self.cell[1]) + 1) * self.columns
+        return range(max(0, first), min(len(self.images), last))
+
+    def update_visible(self):
+        """Drop the photos which have scrolled out of view and ask for the
+        visible thumbnails, then the others nearest to the view first."""
+        visible = self.visible_range()
+        for index in [i for i in self.photos if i not in visible]:
+            self.canvas.delete(self.photos.pop(index)[0])
+
+        wanted = [(i, self.images[i]) for i in visible if i not in self.photos]
+        rest = []
+        for step in range(1, len(self.images)):
+            for index in (visible.stop - 1 + step, visible.start - step):
+                if 0 <= index < len(self.images):
+                    rest.append((index, self.images[index]))
+        self.loader.request(wanted, rest)
+
+    def yscroll(self, first, last):
+        self.vsb.set(first, last)
+        self.update_visible()
+
+    def wheel(self, event):
+        self.canvas.yview_scroll(-1 if event.delta > 0 else 1, 'units')
+
+    def poll(self):
+        """Show the thumbnails loaded since the last poll, and lay the grid
+        out again if more images have been found. A thumbnail loaded for an
+        index which now holds another image, the images having been sorted
+        or filtered since it was asked for, is dropped."""
+        if len(self.images) != self.shown:
+            self.layout()
+        visible = self.visible_range()
+        try:
+            while True:
+                index, image_path, image = self.loader.results.get_nowait()
+                if index in visible and index not in self.photos and \
+                        self.images[index] == image_path:
+                    photo = ImageTk.PhotoImage(image)
+                    x, y = self.cell_origin(index)
+                    item = self.canvas.create_image(
+                            x + (THUMB_SIZE[0] - image.size[0]) // 2,
+                            y + (THUMB_SIZE[1] - image.size[1]) // 2,
+                            image=photo, anchor='nw')
+                    self.photos[index] = (item, photo)
+        except queue.Empty:
+            pass
+        self.poll_job = self.top.after(50, self.poll)
+
+    def draw_selection(self):
+        """Outline the selected images."""
+        if not self.open:
+            return
+        for item in self.outlines.values():
+            self.canvas.delete(item)
+        self.outlines = {}
+        for index in self.selected:
+            x, y = self.cell_origin(index)
+            self.outlines[index] = self.canvas.create_rectangle(
+                    x - 3, y - 3, x + THUMB_SIZE[0] + 2, y + THUMB_SIZE[1] + 2,
+                    outline='yellow', width=3)
+
+    def cell_index(self, event):
+        """Index of the image under the mouse, or None."""
+        x = self.canvas.canvasx(event.x)
+        y = self.canvas.canvasy(event.y)
+        col = int(x // self.cell[0])
+        index = int(y // self.cell[1]) * self.columns + col
+        if col < self.columns and index < len(self.images):
+            return index
+        return None
+
+    def click(self, event):
+        index = self.cell_index(event)
+        if index is not None:
+            self.anchor = index
+            if self.command:
+                self.command(index)
+
+    def toggle_click(self, event):
+        index = self.cell_index(event)
+        if index is not None:
+            self.selected.symmetric_difference_update([index])
+            self.anchor = index
+            self.selection_changed()
+
+    def range_click(self, event):
+        index = self.cell_index(event)
+        if index is not None:
+            low, high = sorted((self.anchor, index))
+            self.selected.update(range(low, high + 1))
+            self.selection_changed()
+
+    def selection_changed(self):
+        if self.select_command:
+            self.select_command()
+        else:
+            self.draw_selection()
+
+    def destroy(self, event):
+        if event.widget is self.top:
+            self.open = False
+            self.top.after_cancel(self.poll_job)
+            self.loader.stop()
@@ -0,0 +1,210 @@
+"""Watch for memory cards being inserted, so each card can be ingested
+without setting the source folder by hand.
+
+A card is any mounted volume with a DCIM folder, found under the folders
+where removable media are mounted. On Linux inotify reports new mount points
+and new images on a card straight away; elsewhere, or if inotify is not
+available, the mount folders are polled. Either way they are rescanned every
+'interval' seconds, as mounting on an existing folder makes no inotify event.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import getpass
+import os
+import select
+import struct
+import sys
+import time
+from ImageJournal import SourceKey
+from ImageScan import ScanJpgFiles
+
+IN_MOVED_TO = 0x00000080
+IN_CLOSE_WRITE = 0x00000008
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+ROOT_EVENTS = IN_CREATE | IN_DELETE | IN_MOVED_TO | IN_ONLYDIR
+CARD_EVENTS = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+
+EVENT = struct.Struct('iIII')   # wd, mask, cookie, len of the name.
+
+def MountRoots():
+    """The folders removable media are mounted in on this platform. On
+    Windows every drive letter is a candidate card."""
+    if sys.platform.startswith('win'):
+        return ['{}:\\'.format(letter) for letter in 'DEFGHIJKLMNOPQRSTUVWXYZ']
+    if sys.platform == 'darwin':
+        return ['/Volumes']
+    user = getpass.getuser()
+    return [
+            root for root in (
+                '/media', os.path.join('/media', user),
+                os.path.join('/run/media', user), '/mnt')
+            if os.path.isdir(root)]
+
+def IsCard(path):
+    return os.path.isdir(os.path.join(path, 'DCIM'))
+
+def FindCards(roots):
+    """The set of cards which are either one of 'roots' or directly in one."""
+    cards = set()
+    for root in roots:
+        if IsCard(root):
+            cards.add(root)
+            continue
+        try:
+            with os.scandir(root) as it:
+                for entry in it:
+                    if entry.is_dir() and IsCard(entry.path):
+                        cards.add(entry.path)
+        except OSError:
+            continue
+    return cards
+
+def NewImages(card, journal=None):
+    """The images on a card which the CopyJournal does not record as copied.
+    Only the directory entries are read, not the images."""
+    return [
+            entry.path for entry in ScanJpgFiles(card)
+            if journal is None or not journal.is_done(
+                SourceKey(entry.path, entry.stat()))]
+
+class Inotify(object):
+    """Minimal inotify through ctypes: watch directories and read the
+    events on them as (directory, mask, name)."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(
+                ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}   # wd: directory
+
+    @classmethod
+    def create(cls):
+        """An Inotify, or None where it is not available."""
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            return cls()
+        except (OSError, AttributeError):
+            return None
+
+    def add(self, directory, mask):
+        wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed", directory)
+        self.watches[wd] = directory
+
+    def read(self, timeout):
+        """Wait up to 'timeout' seconds for events and return them."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            directory = self.watches.get(wd)
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+            if directory is not None:
+                events.append((directory, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class CardWatcher(object):
+    """Reports cards to be ingested: each card when it is inserted, and again
+    when inotify sees new images written to it."""
+
+    def __init__(self, roots=None, interval=2.0):
+        self.roots = list(roots or MountRoots())
+        self.interval = interval
+        self.cards = set()
+        self.started = False
+        self.inotify = Inotify.create()
+        if self.inotify is not None:
+            for root in self.roots:
+                try:
+                    self.inotify.add(root, ROOT_EVENTS)
+                except OSError:
+                    continue
+
+    def watch_card(self, card):
+        """Watch the DCIM folders of a card for new images."""
+        dcim = os.path.join(card, 'DCIM')
+        folders = [dcim]
+        try:
+            with os.scandir(dcim) as it:
+                folders.extend(entry.path for entry in it if entry.is_dir())
+        except OSError:
+            pass
+        for folder in folders:
+            try:
+                self.inotify.add(folder, CARD_EVENTS)
+            except OSError:
+                continue
+
+    def card_of(self, path):
+        for card in self.cards:
+            if path == card or path.startswith(os.path.join(card, '')):
+                return card
+        return None
+
+    def wait(self, timeout=None):
+        """Wait up to 'timeout' seconds, by default the interval, and return
+        the cards which have been inserted or written to, sorted. Cards
+        already inserted are returned by the first call."""
+        if timeout is None:
+            timeout = self.interval
+        changed = set()
+        if not self.started:
+            self.started = True
+        elif self.inotify is not None:
+            for directory, mask, name in self.inotify.read(timeout):
+                card = self.card_of(directory)
+                if card is None:
+                    continue    # A change in a mount folder, rescanned below.
+                if mask & IN_CREATE:
+                    if mask & IN_ISDIR:
+                        # A new DCF folder, e.g. DCIM/101CANON.
+                        self.watch_card(card)
+                        changed.add(card)
+                else:
+                    changed.add(card)
+        else:
+            time.sleep(timeout)
+
+        found = FindCards(self.roots)
+        inserted = found - self.cards
+        self.cards = found
+        for card in inserted:
+            if self.inotify is not None:
+                self.watch_card(card)
+        return sorted(inserted | (changed & found))
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None